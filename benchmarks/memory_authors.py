@@ -0,0 +1,80 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import argparse
+import json
+import os
+import sys
+
+"""
+    Memory per record of large-collaboration records.
+
+    Synthetic recjson records with many authors (listed one by one, without
+    collaboration names) are parsed and rendered as by `heprefs short_info`,
+    without network access, and the memory profile is printed as JSON with
+    "bytes_per_record", the memory retained by each parsed record.  Parsed
+    records are kept, as in batch runs collecting results.
+
+        $ python benchmarks/memory_authors.py                  # 3000 authors
+        $ python benchmarks/memory_authors.py -n 20 --authors 5000
+        $ python benchmarks/memory_authors.py --top 5           # allocation sites
+"""
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import heprefs.profiling as profiling  # noqa: E402
+from heprefs.inspire_article import InspireArticle  # noqa: E402
+
+
+def record(recid, authors):
+    # type: (int, int) -> dict
+    return {
+        "recid": recid,
+        "title": {"title": "Search for new phenomena in a synthetic collaboration"},
+        "authors": [
+            {
+                "full_name": "Author{}, First{}".format(i, i),
+                "first_name": "First{}".format(i),
+                "last_name": "Author{}".format(i),
+                "affiliation": ["Institute {}".format(i % 200)],
+            }
+            for i in range(authors)
+        ],
+        "primary_report_number": ["CERN-EP-2099-{:03d}".format(recid % 1000)],
+        "publication_info": {"title": "Phys.Rev.D", "volume": "99", "year": "2099"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per record of many authors")
+    parser.add_argument("-n", "--records", type=int, default=10)
+    parser.add_argument("--authors", type=int, default=3000)
+    parser.add_argument(
+        "--top", type=int, default=0, help="allocation sites to show (slow)"
+    )
+    args = parser.parse_args()
+
+    texts = [
+        json.dumps([record(recid, args.authors)]).encode("utf-8")
+        for recid in range(args.records)
+    ]
+    profiling.enable(top=args.top)
+    kept = list()
+    for text in texts:
+        article = InspireArticle("synthetic")
+        with profiling.phase("parse", "ins"):
+            article._info = json.loads(text.decode("utf-8"))[0]
+        with profiling.phase("render", "ins"):
+            "\n".join([article.authors(), article.title(), article.abs_url()])
+            article.authors_short()
+        kept.append(article)
+
+    result = profiling.report()
+    parse = [p for p in result["phases"] if p["phase"] == "parse"][0]
+    result["records"] = args.records
+    result["authors"] = args.authors
+    result["json_bytes_per_record"] = len(texts[0])
+    result["bytes_per_record"] = parse["retained_per_call"]
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
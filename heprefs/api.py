@@ -0,0 +1,162 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Dict, Iterable, List, Optional  # noqa: F401
+import asyncio
+from .classify import classify
+from . import profiling
+from . import store
+from .arxiv_article import ArxivArticle
+from .cds_article import CDSArticle
+from .inspire_article import InspireArticle
+
+"""
+    Python API of heprefs, independent of the command-line interface.
+
+    Example:
+
+        >>> import heprefs.api
+        >>> records = heprefs.api.resolve_many_sync(
+        ...     ["1505.02996", "ATLAS-CONF-2017-018"], fields=["title", "abs_url"]
+        ... )
+        >>> records[0]["title"]
+
+    or, within an event loop,
+
+        >>> records = await heprefs.api.resolve_many(keys, concurrency=16)
+
+    Each record is a dictionary with "key", "type", "error" (None on success),
+    and the requested fields.  Lookups share the backends and the local store
+    with the command-line interface.
+"""
+
+
+logger = getLogger(__name__)
+
+types = OrderedDict(
+    [
+        ("arxiv", ArxivArticle),
+        ("cds", CDSArticle),
+        ("ins", InspireArticle),
+    ]
+)
+
+# field name -> method name of article classes
+FIELDS = OrderedDict(
+    [
+        ("title", "title"),
+        ("authors", "authors"),
+        ("authors_short", "authors_short"),
+        ("first_author", "first_author"),
+        ("abs_url", "abs_url"),
+        ("pdf_url", "pdf_url"),
+        ("texkey", "texkey"),
+        ("publication_info", "publication_info"),
+    ]
+)
+DEFAULT_FIELDS = ["title", "authors", "abs_url"]
+DEFAULT_CONCURRENCY = 8
+
+
+class ArticleNotFound(LookupError):
+    pass
+
+
+def construct_article(key, type=None):
+    """Return an article object for the key, or raise ArticleNotFound."""
+    if type in types.keys():
+        classes = [types[type]]
+        force = True
+    elif type is None:
+        classes = list(types.values())
+        force = False
+    else:
+        raise ValueError("invalid type specified")
+
+    for c in classes:
+        obj = c.try_to_construct(key, force=force)  # type: ignore
+        if obj:
+            return obj
+    raise ArticleNotFound("Reference for {} not found.".format(key))
+
+
+def type_of(article):
+    # type: (Any) -> str
+    for name, c in types.items():
+        if isinstance(article, c):
+            return name
+    return ""
+
+
+def resolve(key, type=None, fields=None):
+    # type: (str, Optional[str], Optional[Iterable[str]]) -> Dict[str, Any]
+    """Fetch the article for the key and return a record; errors are raised."""
+    fields = list(fields or DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError("unknown fields: " + ", ".join(unknown))
+
+    article = construct_article(key, type)
+    record = OrderedDict(
+        [("key", key), ("type", type_of(article)), ("error", None)]
+    )  # type: Dict[str, Any]
+    with profiling.phase("render", record["type"]):
+        for f in fields:
+            method = getattr(article, FIELDS[f], None)
+            record[f] = str(method()) if method else None
+    return record
+
+
+def _resolve_or_error(key, type, fields):
+    # type: (str, Optional[str], List[str]) -> Dict[str, Any]
+    try:
+        return resolve(key, type=type, fields=fields)
+    except Exception as e:
+        logger.debug("failed to resolve {}: {}".format(key, e))
+        record = OrderedDict(
+            [("key", key), ("type", type or classify(key)[0]), ("error", e.__str__())]
+        )  # type: Dict[str, Any]
+        for f in fields:
+            record[f] = None
+        return record
+
+
+def _work(key, type, fields):
+    # type: (str, Optional[str], List[str]) -> Dict[str, Any]
+    """Resolve the key in a worker thread, closing the store opened by the thread."""
+    try:
+        return _resolve_or_error(key, type, fields)
+    finally:
+        store.close_default_store()
+
+
+async def resolve_many(keys, fields=None, concurrency=DEFAULT_CONCURRENCY, type=None):
+    """
+    Resolve the keys concurrently and return records in the order of the keys.
+
+    Failures do not raise but are reported in "error" of the records.
+    At most `concurrency` lookups run at the same time.
+    """
+    fields = list(fields or DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError("unknown fields: " + ", ".join(unknown))
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(
+            await asyncio.gather(
+                *[
+                    loop.run_in_executor(executor, _work, key, type, fields)
+                    for key in keys
+                ]
+            )
+        )
+
+
+def resolve_many_sync(keys, fields=None, concurrency=DEFAULT_CONCURRENCY, type=None):
+    """Synchronous version of `resolve_many`, for callers without event loops."""
+    return asyncio.run(
+        resolve_many(keys, fields=fields, concurrency=concurrency, type=type)
+    )
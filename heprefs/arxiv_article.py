@@ -4,15 +4,32 @@ import os
 import arxiv
 import feedparser
 import urllib
+from collections import namedtuple
 from logging import getLogger
+from typing import Optional  # noqa: F401
+import heprefs.classify as classify
+import heprefs.invenio as invenio
+import heprefs.lock as lock
+import heprefs.profiling as profiling
+import heprefs.store as store
 
 logger = getLogger(__name__)
 
+# the subset of `arxiv.Result` kept in the local store
+ArxivInfo = namedtuple(
+    "ArxivInfo", ["entry_id", "updated", "title", "authors", "pdf_url", "doi"]
+)
+
+
+class VersionNotFound(ValueError):
+    pass
+
 
 class ArxivArticle(object):
-    OLD_FORMAT_DEFAULT = "hep-ph"
+    OLD_FORMAT_DEFAULT = classify.OLD_FORMAT_DEFAULT
 
     @classmethod
+    @profiling.profiled("get_info", "arxiv")
     def get_info(cls, arxiv_id):
         client = arxiv.Client()
         search = arxiv.Search(id_list=[arxiv_id])
@@ -31,6 +48,50 @@ class ArxivArticle(object):
             logger.warning(warning_text)
         return result[0]
 
+    @classmethod
+    @profiling.profiled("get_info", "arxiv")
+    def get_infos(cls, arxiv_ids, chunk_size=100):
+        """Return `arxiv.Result` for the IDs, fetched by batched id_list queries."""
+        client = arxiv.Client()
+        results = list()
+        for i in range(0, len(arxiv_ids), chunk_size):
+            chunk = arxiv_ids[i : i + chunk_size]
+            search = arxiv.Search(id_list=chunk, max_results=len(chunk))
+            results += list(client.results(search))
+        return results
+
+    @classmethod
+    def info_to_payload(cls, result):
+        return {
+            "entry_id": result.entry_id,
+            "updated": result.updated.isoformat() if result.updated else "",
+            "title": result.title,
+            "authors": [str(a) for a in result.authors],
+            "pdf_url": result.pdf_url,
+            "doi": result.doi or "",
+        }
+
+    @classmethod
+    def payload_from_invenio(cls, json):
+        arxiv_id = invenio.arxiv_id(json)
+        if not arxiv_id:
+            return None
+        doi = json.get("doi") or ""
+        return {
+            "entry_id": "http://arxiv.org/abs/{}".format(arxiv_id),
+            "updated": "",
+            "title": invenio.title(json),
+            "authors": [
+                invenio.first_last_name(a) for a in invenio.normalize_authors(json)
+            ],
+            "pdf_url": "http://arxiv.org/pdf/{}".format(arxiv_id),
+            "doi": doi[0] if isinstance(doi, list) else doi,
+        }
+
+    @classmethod
+    def payload_to_info(cls, payload):
+        return ArxivInfo(**dict((k, payload.get(k)) for k in ArxivInfo._fields))
+
     @classmethod
     def shorten_author(cls, author):
         author = re.sub("collaboration", "", author, flags=re.IGNORECASE).strip()
@@ -49,6 +110,7 @@ class ArxivArticle(object):
 
     def __init__(self, arxiv_id):
         self._arxiv_id = None
+        self.version = None  # type: Optional[int]
         self.arxiv_id = arxiv_id
         self._info = None
         self._server_name = ""
@@ -59,35 +121,94 @@ class ArxivArticle(object):
 
     @arxiv_id.setter
     def arxiv_id(self, i):
-        new_style = re.match(r"^(\d{4})\.(\d{4,5})$", i)
-        old_style = re.match(r"^([a-zA-Z.-]+/)?\d{7}$", i)
-        if new_style:
-            (first, second) = (new_style.group(1), new_style.group(2))
-            if int(first) >= 1500:
-                self._arxiv_id = (
-                    i if (len(second) == 5) else "{}.0{}".format(first, second)
-                )
-            elif len(second) == 4:
-                self._arxiv_id = i
-            else:
-                raise ValueError("incorrect arXiv id")
-        elif old_style:
-            self._arxiv_id = (
-                i if old_style.group(1) else self.OLD_FORMAT_DEFAULT + "/" + i
-            )
-        else:
-            raise ValueError("incorrect arXiv id")
+        (arxiv_id, version) = classify.normalize_arxiv_id(i)
+        self._arxiv_id = arxiv_id
+        if version:
+            self.set_version(int(version[1:]))
+
+    def set_version(self, version):
+        # type: (Optional[int]) -> None
+        """Specify the version to handle; None for the latest version."""
+        if version is not None and version < 1:
+            raise ValueError("incorrect arXiv version: {}".format(version))
+        self.version = version
+        self._info = None
+
+    def versioned_id(self):
+        # type: () -> str
+        if self.version:
+            return "{}v{}".format(self.arxiv_id, self.version)
+        return self.arxiv_id
 
     @property
     def info(self):
         if not self._info:
-            self._info = self.get_info(self.arxiv_id)
+            payload = self.load_payload()
+            if self.version:
+                versions = self.versions(payload)
+                if self.version > len(versions):
+                    # the stored record may be older than the requested version.
+                    latest = self.info_to_payload(self.get_info(self.arxiv_id))
+                    if self.version_of(latest["entry_id"]) > len(versions):
+                        versions = self.versions(latest)
+                if self.version > len(versions):
+                    raise VersionNotFound(
+                        "arXiv:{} has only {} versions".format(
+                            self.arxiv_id, len(versions)
+                        )
+                    )
+                payload = versions[self.version - 1]
+            self._info = self.payload_to_info(payload)
         return self._info
 
+    @staticmethod
+    def version_of(entry_id):
+        # type: (str) -> int
+        """Return the version in the entry ID, e.g., 2 for ".../1505.02996v2"."""
+        m = re.search(r"v(\d+)$", entry_id)
+        return int(m.group(1)) if m else 0
+
+    def versions(self, payload=None):
+        """Return payloads of all versions, fetched by one query if not stored."""
+        payload = payload or self.load_payload()
+        n_versions = self.version_of(payload["entry_id"])
+        if not n_versions:
+            # constructed from Invenio records; the latest version is unknown.
+            payload = self.info_to_payload(self.get_info(self.arxiv_id))
+            n_versions = self.version_of(payload["entry_id"]) or 1
+        if len(payload.get("versions") or []) != n_versions:
+            ids = ["{}v{}".format(self.arxiv_id, v + 1) for v in range(n_versions)]
+            results = self.get_infos(ids)
+            results.sort(key=lambda r: self.version_of(r.entry_id))
+            payload["versions"] = [self.info_to_payload(r) for r in results]
+            store.remember("arxiv", payload)
+        return payload["versions"]
+
+    def stored_payload(self):
+        record = store.recall(self.arxiv_id)
+        if record.get("arxiv"):
+            return record["arxiv"]
+        for backend in ["ins", "cds"]:
+            payload = record.get(backend) and self.payload_from_invenio(record[backend])
+            if payload:
+                return payload
+        return None
+
+    def load_payload(self):
+        payload = self.stored_payload()
+        if payload:
+            return payload
+        with lock.single_flight("info", "arxiv:" + self.arxiv_id) as flight:
+            payload = self.stored_payload() if flight.waited else None
+            if not payload:
+                payload = self.info_to_payload(self.get_info(self.arxiv_id))
+                store.remember("arxiv", payload)
+        return payload
+
     def _url(self, key):
         if not self._server_name:
             self._server_name = urllib.parse.urlparse(self.info.entry_id).netloc
-        return f"https://{self._server_name}/{key}/{self.arxiv_id}"
+        return f"https://{self._server_name}/{key}/{self.versioned_id()}"
 
     def abs_url(self):
         return self._url("abs")
@@ -115,8 +236,8 @@ class ArxivArticle(object):
 
     def download_parameters(self):
         authors = self.authors_short().replace(", ", "-").replace("et al.", "etal")
-        filename = "{id}-{authors}.pdf".format(id=self.arxiv_id, authors=authors)
-        return self.info.pdf_url, filename
+        filename = "{id}-{authors}.pdf".format(id=self.versioned_id(), authors=authors)
+        return (self.pdf_url() if self.version else self.info.pdf_url), filename
 
     def debug(self):
         data = {
@@ -6,7 +6,11 @@ import re
 from logging import getLogger
 from typing import Tuple  # noqa: F401
 
+import heprefs.classify as classify
 import heprefs.invenio as invenio
+import heprefs.lock as lock
+import heprefs.profiling as profiling
+import heprefs.store as store
 
 try:
     from urllib import quote_plus  # type: ignore   # noqa
@@ -14,12 +18,13 @@ try:
 except ImportError:
     from urllib.parse import quote_plus
     from urllib.request import urlopen
+    from urllib.error import HTTPError
 
 logger = getLogger(__name__)
 
 
 class CDSArticle(object):
-    API = "https://cds.cern.ch/search"
+    API = os.environ.get("HEPREFS_CDS_API") or "https://cds.cern.ch/search"
     RECORD_PATH = "http://cds.cern.ch/record/"
     ARXIV_SERVER = "https://arxiv.org"
     DOI_SERVER = "https://dx.doi.org"
@@ -28,11 +33,10 @@ class CDSArticle(object):
         + "authors,corporate_name,title,abstract,publication_info,files"
     )
 
-    LIKELY_PATTERNS = [
-        r"^[A-Za-z-]+-\d+-\d+$",  # "ATLAS-CONF-2018-001" "CMS PAS EXO-16-009"
-    ]
+    LIKELY_PATTERNS = classify.CDS_PATTERNS
 
     @classmethod
+    @profiling.profiled("get_info", "cds")
     def get_info(cls, query):
         query_url = "{}?p={}&of=recjson&ot={}&rg=3".format(
             cls.API, quote_plus(query), cls.DATA_KEY
@@ -44,7 +48,8 @@ class CDSArticle(object):
         except HTTPError as e:
             raise Exception("Failed to fetch CDS information: " + e.__str__())
         try:
-            results = json.loads(s.decode("utf-8"))
+            with profiling.phase("parse", "cds"):
+                results = json.loads(s.decode("utf-8"))
         except Exception as e:
             raise Exception(
                 "parse failed; query {} to CDS, but seems no result.: ".format(query)
@@ -70,7 +75,7 @@ class CDSArticle(object):
     @classmethod
     def try_to_construct(cls, query, force=False):
         if not force:
-            if not any(re.match(r, query) for r in cls.LIKELY_PATTERNS):
+            if classify.classify(query)[0] != "cds":
                 return False
         return cls(query)
 
@@ -81,9 +86,34 @@ class CDSArticle(object):
     @property
     def info(self):
         if not self._info:
-            self._info = self.get_info(self.query)
+            self._info = self.load_info()
         return self._info
 
+    def stored_info(self):
+        record = store.recall(self.query, "cds")
+        if record.get("cds"):
+            return record["cds"]
+        if record.get("ins"):
+            return invenio.foreign_payload(record["ins"])
+        if record.get("arxiv"):
+            return invenio.from_arxiv(record["arxiv"])
+        return None
+
+    def load_info(self):
+        info = self.stored_info()
+        if info:
+            return info
+        aliases = store.aliases_of_key(self.query, "cds")
+        if not aliases:
+            # results of general queries are not shared via the store.
+            return self.get_info(self.query)
+        with lock.single_flight("info", aliases[0]) as flight:
+            info = self.stored_info() if flight.waited else None
+            if not info:
+                info = self.get_info(self.query)
+                store.remember("cds", info)
+        return info
+
     def abs_url(self):
         # type: () -> str
         if "doi" in self.info:
@@ -109,7 +139,7 @@ class CDSArticle(object):
         ]
         if pdf_files:
             if len(pdf_files) > 1:
-                print("Note: Fulltext PDF file is guessed by its size.")
+                logger.warning("Fulltext PDF file is guessed by its size.")
             pdf_files.sort(key=lambda i: int(i.get("size", 0)), reverse=True)
             return pdf_files[0].get("url", "")
 
@@ -0,0 +1,93 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple  # noqa: F401
+import re
+
+"""
+    Classifier of keys into article types, without constructing articles.
+
+    All the patterns are combined into one compiled regular expression, which is
+    tried in the same order as `heprefs.heprefs.types`, so that the type given
+    here coincides with the one guessed by `construct_article`.
+"""
+
+
+TYPES = ["arxiv", "cds", "ins"]
+UNKNOWN = "unknown"
+OLD_FORMAT_DEFAULT = "hep-ph"
+
+ARXIV_NEW_PATTERN = r"(?P<yymm>\d{4})\.(?P<number>\d{4,5})(?P<version>v\d+)?"
+ARXIV_OLD_PATTERN = r"(?P<archive>[a-zA-Z.-]+/)?(?P<old>\d{7})(?P<old_version>v\d+)?"
+CDS_PATTERNS = [
+    r"[A-Za-z-]+-\d+-\d+",  # "ATLAS-CONF-2018-001" "CMS PAS EXO-16-009"
+]
+INSPIRE_PATTERNS = [
+    r"(doi:)?10\.\d{4,}/.*",  # doi
+    r"find? .+",  # old spires style
+]
+
+MATCHER = re.compile(
+    "|".join(
+        [
+            "(?P<arxiv_new>{})$".format(ARXIV_NEW_PATTERN),
+            "(?P<arxiv_old>{})$".format(ARXIV_OLD_PATTERN),
+            "(?P<cds>{})$".format("|".join(CDS_PATTERNS)),
+            "(?P<ins>{})$".format("|".join(INSPIRE_PATTERNS)),
+        ]
+    )
+)
+
+
+def _normalize_match(m):
+    # type: (re.Match) -> Tuple[str, str]
+    """Return (arXiv ID, version) from a match of MATCHER, or ("", "")."""
+    if m.lastgroup == "arxiv_new":
+        (first, second) = (m.group("yymm"), m.group("number"))
+        if int(first) >= 1500:
+            arxiv_id = "{}.{:0>5}".format(first, second)
+        elif len(second) == 4:
+            arxiv_id = "{}.{}".format(first, second)
+        else:
+            return "", ""
+        return arxiv_id, m.group("version") or ""
+    elif m.lastgroup == "arxiv_old":
+        arxiv_id = (m.group("archive") or OLD_FORMAT_DEFAULT + "/") + m.group("old")
+        return arxiv_id, m.group("old_version") or ""
+    return "", ""
+
+
+def normalize_arxiv_id(i):
+    # type: (str) -> Tuple[str, str]
+    """Return (arXiv ID, version) with version like "v2" or "", or raise ValueError."""
+    m = MATCHER.match(i)
+    arxiv_id, version = _normalize_match(m) if m else ("", "")
+    if not arxiv_id:
+        raise ValueError("incorrect arXiv id")
+    return arxiv_id, version
+
+
+def classify(key):
+    # type: (str) -> Tuple[str, str]
+    """Return (type, normalized key); type is UNKNOWN if not guessed."""
+    m = MATCHER.match(key)
+    if m is None:
+        return UNKNOWN, key
+    elif m.lastgroup in ["cds", "ins"]:
+        return m.lastgroup, key
+    arxiv_id, version = _normalize_match(m)
+    if not arxiv_id:
+        # e.g., "1412.12345"; no other patterns match such keys.
+        return UNKNOWN, key
+    return "arxiv", arxiv_id + version
+
+
+def classify_many(keys):
+    # type: (Iterable[str]) -> OrderedDict
+    """Classify the keys and return normalized keys grouped by types."""
+    groups = OrderedDict(
+        (t, list()) for t in TYPES + [UNKNOWN]
+    )  # type: OrderedDict[str, List[str]]
+    for key in keys:
+        (t, normalized) = classify(key)
+        groups[t].append(normalized)
+    return groups
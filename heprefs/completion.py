@@ -0,0 +1,282 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from typing import Any, Dict, Iterable, List, Optional, Tuple  # noqa: F401
+import bisect
+import json
+import mmap
+import os
+import re
+import heprefs.store as store
+
+"""
+    Index of known keys for shell completion.
+
+    The index is a text file of lines "key<TAB>updated<TAB>description", sorted
+    by keys with ASCII letters lower-cased, so that keys with a prefix are found
+    by binary search on the memory-mapped file regardless of the case.  The
+    most recently updated lines are also kept, newest first, in
+    "<index>.recent", from which completions are taken if too many keys have
+    the prefix; each request thus reads a bounded part of the files.
+
+    The index is updated by merging the lines of the records saved one by one,
+    and rebuilt after bulk changes (e.g., `ingest` or `library scan`).
+"""
+
+
+MAX_COMPLETIONS = 50
+MAX_SCAN = 1 << 16  # bytes of lines with the prefix to read from the index
+RECENT_SIZE = 1000  # lines in the recent file
+MAX_SQL_VARIABLES = 500
+
+
+def index_path():
+    # type: () -> str
+    return os.path.join(os.path.dirname(store.default_path()), "completion.idx")
+
+
+def recent_path(path):
+    # type: (str) -> str
+    return path + ".recent"
+
+
+def _clean(text):
+    # type: (str) -> str
+    return " ".join((text or "").split())
+
+
+TITLE = (
+    "coalesce(json_extract(records.data, '$.arxiv.title'), "
+    + "json_extract(records.data, '$.ins.title.title'), "
+    + "json_extract(records.data, '$.cds.title.title'))"
+)
+DOIS = ", ".join(
+    "json_extract(records.data, '$.{}.doi')".format(b) for b in store.BACKENDS
+)
+
+
+def _select(record_store, query, values=None):
+    # type: (store.Store, str, Optional[List[str]]) -> List[tuple]
+    """Run the query, with "IN (?)" filled by the values in chunks if given."""
+    if values is None:
+        return record_store.db.execute(query).fetchall()
+    rows = list()  # type: List[tuple]
+    for i in range(0, len(values), MAX_SQL_VARIABLES):
+        chunk = values[i : i + MAX_SQL_VARIABLES]
+        rows += record_store.db.execute(
+            query.replace("(?)", "({})".format(",".join("?" * len(chunk)))), chunk
+        ).fetchall()
+    return rows
+
+
+def _doi(key, values):
+    # type: (str, Iterable[Any]) -> str
+    """Return the DOI in the payloads as printed, for the lower-cased key."""
+    for value in values:
+        if isinstance(value, str) and value.startswith("["):
+            value = json.loads(value)  # json_extract gives arrays as JSON
+        for doi in store.as_list(value):
+            if isinstance(doi, str) and doi.lower() == key:
+                return doi
+    return key
+
+
+def _rows(record_store, ids=None):
+    # type: (store.Store, Optional[List[str]]) -> List[Tuple[str, float, str]]
+    """Return (key, updated, description) of the records and the library files.
+
+    If `ids` is given, only the records with the canonical IDs are read.  Keys
+    are as printed, e.g., DOIs in the original case, and described by titles.
+    """
+    query = (
+        "SELECT aliases.alias, records.updated, {}, {} ".format(TITLE, DOIS)
+        + "FROM aliases JOIN records ON aliases.id = records.id"
+    )
+    rows = list()  # type: List[Tuple[str, float, str]]
+    for row in _select(
+        record_store, query + (" WHERE records.id IN (?)" if ids else ""), ids
+    ):
+        kind, key = row[0].split(":", 1)
+        if kind in ["ins", "cds"]:
+            continue  # recids are not keys
+        rows.append(
+            (_doi(key, row[3:]) if kind == "doi" else key, row[1] or 0, row[2] or "")
+        )
+
+    try:
+        library = record_store.db.execute(
+            "SELECT identifier, mtime, path FROM library WHERE identifier != ''"
+        ).fetchall()
+    except Exception:  # library is not yet created
+        return rows
+    # files are described by the titles of their records (of any version)
+    aliases = dict((i, re.sub(r"^(arxiv:.*)v\d+$", r"\1", i)) for i, _, _ in library)
+    titles = dict(
+        _select(
+            record_store,
+            "SELECT aliases.alias, {} FROM aliases ".format(TITLE)
+            + "JOIN records ON aliases.id = records.id WHERE aliases.alias IN (?)",
+            sorted(set(aliases.values())),
+        )
+    )
+    for identifier, mtime, path in library:
+        description = titles.get(aliases[identifier]) or os.path.basename(path)
+        rows.append((identifier.split(":", 1)[1], mtime or 0, description))
+    return rows
+
+
+def _search_key(key):
+    # type: (Any) -> bytes
+    """Return the key to sort and search by; ASCII letters are lower-cased."""
+    return (key if isinstance(key, bytes) else key.encode("utf-8")).lower()
+
+
+def _entries(rows):
+    # type: (Iterable[Tuple[str, float, str]]) -> Dict[bytes, bytes]
+    """Return the lines of the index for the rows, by their search keys."""
+    entries = dict()  # type: Dict[bytes, Tuple[float, str, str]]
+    for key, updated, description in rows:
+        k = _search_key(key)
+        if k not in entries:
+            entries[k] = (updated, key, _clean(description))
+        elif entries[k][0] < updated:
+            # the latest is kept, while any title is kept as the description
+            entries[k] = (updated, key, _clean(description) or entries[k][2])
+    return dict((k, _line(v[1], v[0], v[2])) for k, v in entries.items())
+
+
+def _line(key, updated, description):
+    # type: (str, float, str) -> bytes
+    return "{}\t{:.0f}\t{}".format(key, updated, description).encode("utf-8")
+
+
+def _key(line):
+    # type: (bytes) -> bytes
+    return _search_key(line.split(b"\t", 1)[0])
+
+
+def _updated(line):
+    # type: (bytes) -> int
+    fields = line.split(b"\t", 2)
+    return int(fields[1] or 0) if len(fields) > 1 else 0
+
+
+def _write(path, lines, recent):
+    # type: (str, List[bytes], List[bytes]) -> None
+    for target, content in [(recent_path(path), recent), (path, lines)]:
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(line + b"\n" for line in content))
+        os.replace(tmp, target)
+
+
+def _read_lines(path):
+    # type: (str) -> List[bytes]
+    with open(path, "rb") as f:
+        return f.read().splitlines()
+
+
+def build_index(record_store, path=None):
+    # type: (store.Store, Optional[str]) -> int
+    """Write the index of keys in the store and the library; return the size."""
+    path = path or index_path()
+    entries = _entries(_rows(record_store))
+    lines = [entries[k] for k in sorted(entries)]
+    _write(path, lines, sorted(lines, key=lambda line: -_updated(line))[:RECENT_SIZE])
+    return len(lines)
+
+
+def update_index(record_store, path=None):
+    # type: (store.Store, Optional[str]) -> int
+    """Merge the records modified in the store into the index; return the size.
+
+    The index is rebuilt if the modified records are unknown.
+    """
+    path = path or index_path()
+    ids = record_store.modified_ids
+    if ids is None or not all(os.path.isfile(p) for p in [path, recent_path(path)]):
+        return build_index(record_store, path)
+    lines = _read_lines(path)
+    keys = [_key(line) for line in lines]
+    changed = dict()  # type: Dict[bytes, bytes]
+    for k, line in _entries(_rows(record_store, sorted(ids))).items():
+        i = bisect.bisect_left(keys, k)
+        if i < len(keys) and keys[i] == k:
+            if lines[i] == line or _updated(lines[i]) > _updated(line):
+                continue
+            lines[i] = line
+        else:
+            keys.insert(i, k)
+            lines.insert(i, line)
+        changed[k] = line
+    if changed:
+        recent = [
+            line for line in _read_lines(recent_path(path)) if _key(line) not in changed
+        ] + list(changed.values())
+        recent.sort(key=lambda line: -_updated(line))
+        _write(path, lines, recent[:RECENT_SIZE])
+    return len(lines)
+
+
+def _line_start(mm, pos):
+    # type: (mmap.mmap, int) -> int
+    return mm.rfind(b"\n", 0, pos) + 1
+
+
+def _lower_bound(mm, target):
+    # type: (mmap.mmap, bytes) -> int
+    """Return the position of the first line whose search key is not below target."""
+    low, high = (0, len(mm))
+    while low < high:
+        middle = (low + high) // 2
+        start = _line_start(mm, middle)
+        end = mm.find(b"\t", start)
+        if _search_key(mm[start:end]) < target:
+            low = mm.find(b"\n", middle) + 1 or len(mm)
+        else:
+            high = start
+    return _line_start(mm, low)
+
+
+def _recent(path, target, limit):
+    # type: (str, bytes, int) -> List[bytes]
+    try:
+        lines = _read_lines(recent_path(path))
+    except (IOError, OSError):
+        return []
+    return [line for line in lines if _key(line).startswith(target)][:limit]
+
+
+def complete(prefix, path=None):
+    # type: (str, Optional[str]) -> List[Tuple[str, str]]
+    """Return (key, description) of keys with the prefix, recently updated first.
+
+    Prefixes are compared without the case of ASCII letters.
+    """
+    path = path or index_path()
+    try:
+        f = open(path, "rb")
+    except (IOError, OSError):
+        return []
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        target = _search_key(prefix)
+        start = _lower_bound(mm, target)
+        # no UTF-8 text contains the byte 0xff
+        end = _lower_bound(mm, target + b"\xff")
+        if end - start <= MAX_SCAN:
+            results = mm[start:end].splitlines()
+        else:
+            # too many keys; the most recent ones, and the first ones if not enough
+            results = _recent(path, target, MAX_COMPLETIONS)
+            known = set(_key(line) for line in results)
+            results += [
+                line
+                for line in mm[start : start + MAX_SCAN].splitlines()[:-1]
+                if _key(line) not in known
+            ]
+        mm.close()
+
+    results.sort(key=lambda line: -_updated(line))
+    fields = [line.decode("utf-8").split("\t", 2) for line in results[:MAX_COMPLETIONS]]
+    return [(f[0], f[2] if len(f) > 2 else "") for f in fields]
@@ -2,15 +2,23 @@
 
 from __future__ import absolute_import, division, print_function
 import click
+import click.shell_completion
 import os
 import sys
 import re
+import shutil
+import sqlite3
 import tarfile
 from logging import basicConfig, getLogger, DEBUG
-from collections import OrderedDict
-from .arxiv_article import ArxivArticle
-from .cds_article import CDSArticle
-from .inspire_article import InspireArticle
+from . import classify as key_classifier
+from . import completion
+from . import library as local_library
+from . import lock
+from . import profiling
+from . import store
+
+# Backends (and modules using them) are imported in functions, since their
+# dependencies are slow to import and not needed for shell completion.
 
 __author__ = "Sho Iwamoto / Misho"
 __version__ = "0.1.5"
@@ -19,36 +27,86 @@ __license__ = "MIT"
 basicConfig(level=DEBUG)
 logger = getLogger(__name__)
 
-types = OrderedDict(
-    [
-        ("arxiv", ArxivArticle),
-        ("cds", CDSArticle),
-        ("ins", InspireArticle),
-    ]
-)
+types = key_classifier.TYPES
 
 
 def retrieve_hook(bar):
     return lambda b, c, t: bar.update(min(int(b * c / t * 100), 100))
 
 
-def construct_article(key, type=None):
-    if type in types.keys():
-        classes = [types[type]]
-        force = True
-    elif type is None:
-        classes = list(types.values())
-        force = False
-    else:
-        raise Exception("invalid type specified")
+def download_file(url, filename):
+    """
+    Download to filename via a temporary ".part" file.
+
+    Concurrent heprefs processes downloading the same file are coordinated so
+    that only the first one downloads and the others use the completed file.
+    """
+    with lock.single_flight("download", os.path.abspath(filename)) as flight:
+        if flight.waited and os.path.isfile(filename):
+            click.echo("{} downloaded by another process.".format(filename), err=True)
+            return
+        click.echo("Downloading {} ...".format(url), err=True)
+        part = filename + ".part"
+        try:
+            with click.progressbar(length=100, label=filename, file=sys.stderr) as bar:
+                try:
+                    import urllib
+
+                    urllib.urlretrieve(url, part, reporthook=retrieve_hook(bar))  # type: ignore
+                except AttributeError:
+                    from urllib import request
+
+                    request.urlretrieve(url, part, reporthook=retrieve_hook(bar))
+            os.replace(part, filename)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def is_arxiv(article):
+    from .arxiv_article import ArxivArticle
+
+    return isinstance(article, ArxivArticle)
+
+
+def article_key(article):
+    return article.versioned_id() if is_arxiv(article) else article.query
 
-    for c in classes:
-        obj = c.try_to_construct(key, force=force)  # type: ignore
-        if obj:
-            return obj
 
-    click.echo("Reference for {} not found.".format(key), err=True)
-    sys.exit(1)
+def set_arxiv_version(article, version):
+    if version is None:
+        return
+    if not is_arxiv(article):
+        click.echo("`--version` is available only for arXiv articles.", err=True)
+        sys.exit(1)
+    article.set_version(version)
+
+
+version_option = click.option(
+    "--version",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Specify the version of arXiv article (latest if unspecified)",
+)
+
+
+def schedule_prefetch(article):
+    from . import prefetch
+
+    try:
+        prefetch.schedule(article, article_key(article))
+    except Exception as e:  # prefetch must not break the command.
+        logger.debug("prefetch is not started: " + e.__str__())
+
+
+def construct_article(key, type=None):
+    from . import api
+
+    try:
+        return api.construct_article(key, type)
+    except api.ArticleNotFound as e:
+        click.echo(e.__str__(), err=True)
+        sys.exit(1)
 
 
 @click.group(
@@ -57,8 +115,48 @@ def construct_article(key, type=None):
 )
 @click.version_option(__version__, "-V", "--version")
 # @click.option('-v', '--verbose', is_flag=True, default=False, help="Show verbose output")
-def heprefs_main(**args):
-    pass
+@click.option(
+    "--profile-memory",
+    is_flag=True,
+    default=False,
+    help="Report memory usage of each phase as JSON to stderr",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False),
+    help="Write the memory report to the file instead of stderr",
+)
+def heprefs_main(profile_memory, profile_output):
+    if profile_memory or profile_output:
+        profiling.enable()
+        click.get_current_context().call_on_close(
+            lambda: write_memory_profile(profile_output)
+        )
+
+
+def write_memory_profile(path):
+    if path:
+        with open(path, "w") as f:
+            f.write(profiling.dumps_report() + "\n")
+    else:
+        click.echo(profiling.dumps_report(), err=True)
+
+
+@heprefs_main.result_callback()
+def update_completion_index(*args, **kwargs):
+    record_store = store.loaded_store()
+    if record_store is not None and record_store.modified:
+        try:
+            completion.update_index(record_store)
+        except (OSError, sqlite3.Error) as e:
+            logger.debug("completion index is not updated: " + e.__str__())
+
+
+def complete_key(ctx, param, incomplete):
+    return [
+        click.shell_completion.CompletionItem(key, help=description)
+        for (key, description) in completion.complete(incomplete)
+    ]
 
 
 def heprefs_subcommand(help_msg):
@@ -66,10 +164,10 @@ def heprefs_subcommand(help_msg):
     d2 = click.option(
         "-t",
         "--type",
-        type=click.Choice(types.keys()),
+        type=click.Choice(types),
         help="Specify article type (guessed if unspecified)",
     )
-    d3 = click.argument("key", required=True)
+    d3 = click.argument("key", required=True, shell_complete=complete_key)
 
     def decorator(func):
         d1(d2(d3(func)))
@@ -79,8 +177,17 @@ def heprefs_subcommand(help_msg):
 
 def with_article(func):
     def decorator(key, type, **kwargs):
+        from . import api
+        from .arxiv_article import VersionNotFound
+
         article = construct_article(key, type)
-        func(article, **kwargs)
+        try:
+            # "get_info" and "parse" run by the command are included in "render".
+            with profiling.phase("render", api.type_of(article)):
+                func(article, **kwargs)
+        except VersionNotFound as e:
+            click.echo(e.__str__(), err=True)
+            sys.exit(1)
 
     decorator.__name__ = func.__name__
     return decorator
@@ -110,12 +217,13 @@ def abs(article):
     url = article.abs_url()
     click.echo("Opening {} ...".format(url), err=True)
     click.launch(url)
+    schedule_prefetch(article)
 
 
 @heprefs_subcommand(help_msg="Open PDF with Browser")
 @with_article
 def pdf(article):
-    url = article.pdf_url()
+    url = local_library.local_copy(article_key(article)) or article.pdf_url()
     click.echo("Opening {} ...".format(url), err=True)
     click.launch(url)
 
@@ -134,27 +242,44 @@ def short_info(article, shortauthors):
             abs_url=article.abs_url(),
         )
     )
+    schedule_prefetch(article)
 
 
 @heprefs_subcommand(help_msg="Download PDF file and display the filename")
 @click.option(
     "-o", "--open", is_flag=True, default=False, help="Open PDF file by viewer"
 )
+@click.option(
+    "-d",
+    "--download",
+    is_flag=True,
+    default=False,
+    help="Download even if a local copy is found",
+)
+@version_option
 @with_article
-def get(article, open):
+def get(article, open, download, version):
+    from . import prefetch
+
+    set_arxiv_version(article, version)
+    local = "" if download else local_library.local_copy(article_key(article))
+    if local:
+        click.echo("Local copy found.", err=True)
+        click.echo(local)
+        if open:
+            click.launch(local)
+        return
+
     (pdf_url, filename) = article.download_parameters()
     filename = re.sub(r'[\\/*?:"<>|]', "", filename)
-    click.echo("Downloading {} ...".format(pdf_url), err=True)
-
-    with click.progressbar(length=100, label=filename, file=sys.stderr) as bar:
-        try:
-            import urllib
-
-            urllib.urlretrieve(pdf_url, filename, reporthook=retrieve_hook(bar))  # type: ignore
-        except AttributeError:
-            from urllib import request
-
-            request.urlretrieve(pdf_url, filename, reporthook=retrieve_hook(bar))
+    # waits for a running prefetch
+    local = "" if download else prefetch.prefetched(article, "pdf")
+    if local and not os.path.isfile(filename):
+        click.echo("Prefetched file found.", err=True)
+        shutil.copyfile(local, filename)
+    else:
+        download_file(pdf_url, filename)
+    local_library.register_download(filename, article_key(article))
     # display the name so that piped to other scripts
     click.echo(filename)
     if open:
@@ -165,28 +290,27 @@ def get(article, open):
 @click.option(
     "-u", "--untar", is_flag=True, default=False, help="Untar downloaded file"
 )
+@version_option
 @with_article
-def source(article, untar):
-    if isinstance(article, ArxivArticle):
+def source(article, untar, version):
+    from . import prefetch
+
+    if is_arxiv(article):
+        article.set_version(version or article.version)
         url = article.source_url()
-        filename = "{}.tar.gz".format(article.arxiv_id)
-        dirname = "{}.source".format(article.arxiv_id)
+        filename = "{}.tar.gz".format(article.versioned_id())
+        dirname = "{}.source".format(article.versioned_id())
     else:
         click.echo("`source` is available only for arXiv articles.", err=True)
         sys.exit(1)
 
     filename = re.sub(r'[\\/*?:"<>|]', "", filename)
-    click.echo("Downloading {} ...".format(url), err=True)
-
-    with click.progressbar(length=100, label=filename, file=sys.stderr) as bar:
-        try:
-            import urllib
-
-            urllib.urlretrieve(url, filename, reporthook=retrieve_hook(bar))  # type: ignore
-        except AttributeError:
-            from urllib import request
-
-            request.urlretrieve(url, filename, reporthook=retrieve_hook(bar))
+    local = prefetch.prefetched(article, "source")
+    if local and not os.path.isfile(filename):
+        click.echo("Prefetched file found.", err=True)
+        shutil.copyfile(local, filename)
+    else:
+        download_file(url, filename)
 
     if not os.path.isfile(filename):
         click.echo(
@@ -219,6 +343,178 @@ Execute `gunzip {filename}` and inspect the file.""".format(
     click.echo(filename)
 
 
+@heprefs_main.group(
+    short_help="manage the index of local PDF files",
+    help="Manage the index of local PDF files used by `get` and `pdf`",
+)
+def library():
+    pass
+
+
+@library.command(
+    short_help="index PDF files in a directory",
+    help="Index PDF files in DIR; unchanged files are skipped on rescans",
+)
+@click.option(
+    "-j", "--jobs", type=int, default=None, help="Number of processes for hashing"
+)
+@click.argument("dir", required=True, type=click.Path(exists=True, file_okay=False))
+def scan(dir, jobs):
+    record_store = store.default_store()
+    if record_store is None:
+        click.echo("Local store is not available.", err=True)
+        sys.exit(1)
+    result = local_library.Library(record_store).scan(dir, jobs=jobs)
+    click.echo(
+        "{files} files in {dir}: {updated} indexed ({identified} identified, "
+        "{hashed} hashed), {removed} removed.".format(dir=dir, **result)
+    )
+
+
+@heprefs_main.command(
+    name="classify",
+    short_help="classify keys into article types",
+    help="Classify KEYS (or lines of the standard input) into article types "
+    + "without fetching, and display normalized keys grouped by types",
+)
+@click.argument("keys", nargs=-1)
+def classify_keys(keys):
+    if not keys:
+        keys = (line.strip() for line in sys.stdin)
+    groups = key_classifier.classify_many(k for k in keys if k)
+    for t, normalized in groups.items():
+        for k in normalized:
+            click.echo("{}\t{}".format(t, k))
+
+
+@heprefs_main.command(
+    name="metrics",
+    short_help="display citation metrics of articles",
+    help="Display citation counts of inspireHEP records for KEYS (or lines of the "
+    + "standard input) or for the records matching a query, followed by the "
+    + "total numbers of citations and the h-index",
+)
+@click.option("-q", "--query", help="inspireHEP query instead of KEYS")
+@click.option(
+    "-s",
+    "--self-citations",
+    is_flag=True,
+    default=False,
+    help="Also display citations excluding self-citations",
+)
+@click.argument("keys", nargs=-1)
+def show_metrics(keys, query, self_citations):
+    from . import metrics as citation_metrics
+
+    if query:
+        rows = citation_metrics.query_rows(query, self_citations=self_citations)
+    else:
+        if not keys:
+            keys = [line.strip() for line in sys.stdin]
+        (recids, unresolved) = citation_metrics.resolve_recids(k for k in keys if k)
+        for key in unresolved:
+            click.echo("Reference for {} not found.".format(key), err=True)
+        rows = citation_metrics.citation_rows(recids, self_citations=self_citations)
+
+    displayed = list()
+    for row in rows:
+        click.echo("\t".join(str(v) for v in row.values()))
+        displayed.append(row)
+    for k, v in citation_metrics.summary(displayed, self_citations).items():
+        click.echo("# {}: {}".format(k, v))
+
+
+@heprefs_main.command(
+    short_help="update records in the local store",
+    help="Update the records in the local store that are modified on the servers "
+    + "since the last refresh",
+)
+@click.option(
+    "-t",
+    "--type",
+    "backends",
+    type=click.Choice(store.BACKENDS),
+    multiple=True,
+    help="Refresh only records of the type (can be repeated)",
+)
+@click.option(
+    "--since", help="Check modifications since the date (YYYY-MM-DD) for inspire/CDS"
+)
+def refresh(backends, since):
+    from . import refresh as store_refresh
+
+    record_store = store.default_store()
+    if record_store is None:
+        click.echo("Local store is not available.", err=True)
+        sys.exit(1)
+    for backend in backends or store.BACKENDS:
+        if backend == "arxiv":
+            (checked, updated) = store_refresh.refresh_arxiv(record_store)
+        else:
+            (checked, updated) = store_refresh.refresh_invenio(
+                record_store, backend, since=since
+            )
+        click.echo(
+            "{}: {} records checked, {} updated.".format(backend, checked, updated)
+        )
+
+
+@heprefs_main.command(
+    short_help="store records of a JSON dump",
+    help="Store the records in FILE, a JSON dump (array or lines, optionally "
+    + "gzipped) of inspireHEP or CDS, so that they are looked up locally",
+)
+@click.option(
+    "-t",
+    "--type",
+    "backend",
+    type=click.Choice(["ins", "cds"]),
+    default="ins",
+    help="Backend of the records",
+)
+@click.option(
+    "-j", "--jobs", type=int, default=None, help="Number of processes to normalize"
+)
+@click.option(
+    "--chunk-size", type=int, default=1000, help="Number of records per process task"
+)
+@click.argument("file", required=True, type=click.Path(exists=True, dir_okay=False))
+def ingest(file, backend, jobs, chunk_size):
+    from . import ingest as dump_ingest
+
+    record_store = store.default_store()
+    if record_store is None:
+        click.echo("Local store is not available.", err=True)
+        sys.exit(1)
+    try:
+        result = dump_ingest.ingest(
+            record_store, file, backend=backend, jobs=jobs, chunk_size=chunk_size
+        )
+    except ValueError as e:
+        click.echo("Failed to read {}: {}".format(file, e), err=True)
+        sys.exit(1)
+    click.echo(
+        "{records} records in {file}: {stored} stored, {skipped} skipped, "
+        "{malformed} malformed.".format(file=file, **result)
+    )
+
+
+@heprefs_subcommand(help_msg="display versions of the arXiv article")
+@with_article
+def versions(article):
+    if not is_arxiv(article):
+        click.echo("`versions` is available only for arXiv articles.", err=True)
+        sys.exit(1)
+    for i, payload in enumerate(article.versions()):
+        click.echo(
+            "v{}\t{}\t{}".format(
+                i + 1,
+                (payload.get("updated") or "")[:10],
+                re.sub(r"\s+", " ", payload.get("title") or ""),
+            )
+        )
+
+
 @heprefs_subcommand(help_msg="display information")
 @with_article
 def debug(article):
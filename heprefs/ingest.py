@@ -0,0 +1,254 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Any, Dict, Iterator, List, Optional, Tuple  # noqa: F401
+import gzip
+import io
+import json
+import os
+import re
+import heprefs.invenio as invenio
+import heprefs.store as store
+from heprefs.cds_article import CDSArticle
+from heprefs.inspire_article import InspireArticle
+
+"""
+    Bulk ingestion of inspireHEP/CDS JSON dumps into the local store.
+
+    Dumps are JSON arrays, JSON lines, or concatenated JSON objects, possibly
+    gzipped, and are parsed as streams.  Records are normalized by chunks in
+    worker processes and written to the store by one transaction per chunk;
+    only a bounded number of chunks are in flight, so that memory use does
+    not grow with the size of dumps.
+
+    Records in the legacy recjson format (with "recid") are used as they are,
+    and those of the current inspireHEP schema (with "control_number",
+    optionally wrapped in "metadata") are converted to recjson.
+"""
+
+
+logger = getLogger(__name__)
+
+DATA_KEYS = {
+    "ins": InspireArticle.DATA_KEY.split(",")
+    + ["doi", InspireArticle.CITATIONS_KEY, InspireArticle.CITATIONS_WITHOUT_SELF_KEY],
+    "cds": CDSArticle.DATA_KEY.split(",") + ["doi"],
+}
+CHUNK_SIZE = 1000
+READ_SIZE = 1 << 20
+MAX_RECORD_SIZE = 1 << 26  # characters; longer records are taken as malformed
+
+_SEPARATORS = re.compile(r"[\s,\[\]]*")
+_INDENT = re.compile(r"[ \t,\[]*")
+
+
+def _column(buffer, pos, column):
+    # type: (str, int, int) -> int
+    """Return the column of pos, given the column of the start of the buffer."""
+    newline = buffer.rfind("\n", 0, pos)
+    return pos - newline - 1 if newline >= 0 else column + pos
+
+
+def open_dump(path):
+    # type: (str) -> Any
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return io.open(path, "r", encoding="utf-8")
+
+
+def iter_records(f, read_size=READ_SIZE, counts=None):
+    # type: (Any, int, Optional[Dict[str, int]]) -> Iterator[dict]
+    """Yield JSON objects in the stream, reading `read_size` characters at once.
+
+    Brackets and commas between objects are skipped, so that an array of
+    records is read without loading the whole array.  Malformed records are
+    counted in counts["malformed"] if given, and skipped to the next line that
+    starts an object not deeper than the first record; nested objects of
+    pretty-printed records are thus not taken as records.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos = ("", 0)
+    size = read_size
+    eof = False
+    column = 0  # of the start of the buffer, until the first record is found
+    depth = None  # type: Optional[int]
+    skipping = False  # to the next line starting a record
+    while True:
+        if skipping:
+            newline = buffer.find("\n", pos)
+            if newline < 0 or len(buffer) <= newline + 1 + (depth or 0):
+                if eof:
+                    return
+                # the rest of the line is not kept, as it may be long.
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer, pos = ((buffer[newline:] if newline >= 0 else "") + chunk, 0)
+                continue
+            indent = _INDENT.match(buffer, newline + 1)
+            start = indent.end() if indent else newline + 1
+            skipping = not (
+                start - newline - 1 <= (depth or 0) and buffer[start : start + 1] == "{"
+            )
+            pos = newline + 1 if skipping else start
+            continue
+        separators = _SEPARATORS.match(buffer, pos)
+        pos = separators.end() if separators else pos
+        if pos == len(buffer):
+            if eof:
+                return
+            column = _column(buffer, pos, column)
+            buffer, pos = (f.read(read_size), 0)
+            eof = not buffer
+            continue
+        if depth is None:
+            depth = _column(buffer, pos, column)
+        try:
+            obj, pos = decoder.raw_decode(buffer, pos)
+        except ValueError as e:
+            # records cut by the buffer fail in the last line, as no JSON
+            # string contains newlines.
+            newline = buffer.find("\n", getattr(e, "pos", pos))
+            if newline < 0 and not eof and len(buffer) - pos < MAX_RECORD_SIZE:
+                # the record continues beyond the buffer; read more at a growing size.
+                chunk = f.read(size)
+                eof = not chunk
+                buffer, pos = (buffer[pos:] + chunk, 0)
+                size *= 2
+                continue
+            logger.debug("malformed record skipped: " + buffer[pos : pos + 80])
+            if counts is not None:
+                counts["malformed"] = counts.get("malformed", 0) + 1
+            skipping = True
+            size = read_size
+            continue
+        if isinstance(obj, dict):
+            yield obj
+        size = read_size
+
+
+def _values(items, key="value"):
+    # type: (Any, str) -> List[Any]
+    return [
+        i.get(key) for i in store.as_list(items) if isinstance(i, dict) and i.get(key)
+    ]
+
+
+def _author(a):
+    # type: (dict) -> dict
+    author = {"full_name": a.get("full_name") or ""}
+    names = author["full_name"].split(", ", 1)
+    if len(names) == 2:
+        author["last_name"], author["first_name"] = names
+    return author
+
+
+def from_inspire_schema(m):
+    # type: (dict) -> dict
+    """Convert a record of the current inspireHEP schema to recjson."""
+    result = {
+        "recid": m["control_number"],
+        "title": {"title": (_values(m.get("titles"), "title") or [""])[0]},
+        "authors": [_author(a) for a in m.get("authors") or [] if isinstance(a, dict)],
+        "corporate_name": [
+            {"collaboration": c} for c in _values(m.get("collaborations"))
+        ],
+        "system_control_number": [
+            {"institute": "INSPIRETeX", "value": t} for t in m.get("texkeys") or []
+        ],
+    }  # type: Dict[str, Any]
+    numbers = ["arXiv:" + i for i in _values(m.get("arxiv_eprints"))] + _values(
+        m.get("report_numbers")
+    )
+    if numbers:
+        result["primary_report_number"] = numbers
+    dois = _values(m.get("dois"))
+    if dois:
+        result["doi"] = dois[0] if len(dois) == 1 else dois
+    abstracts = _values(m.get("abstracts"))
+    if abstracts:
+        result["abstract"] = {"summary": abstracts[0]}
+    publications = [
+        p for p in m.get("publication_info") or [] if p.get("journal_title")
+    ]
+    if publications:
+        p = publications[0]
+        result["publication_info"] = {
+            "title": p.get("journal_title") or "",
+            "volume": p.get("journal_volume") or "",
+            "year": str(p.get("year") or ""),
+            "pagination": p.get("artid") or p.get("page_start") or "",
+        }
+    if "citation_count" in m:
+        result[InspireArticle.CITATIONS_KEY] = m["citation_count"]
+    return result
+
+
+def normalize(backend, record):
+    # type: (str, dict) -> Optional[Tuple[dict, List[str]]]
+    """Return the recjson payload to store and its aliases, or None if not usable."""
+    record = record.get("metadata", record)
+    try:
+        if "recid" not in record:
+            if "control_number" not in record:
+                return None
+            record = from_inspire_schema(record)
+
+        payload = dict((k, record[k]) for k in DATA_KEYS[backend] if k in record)
+        if isinstance(payload.get("publication_info"), list):
+            payload["publication_info"] = (payload["publication_info"] or [None])[0]
+        payload["authors"] = invenio.normalize_authors(payload)
+        payload["corporate_name"] = [
+            {"collaboration": c} for c in invenio.collaborations(payload)
+        ]
+        # these raise exceptions for malformed records, which are skipped.
+        invenio.arxiv_id(payload)
+        invenio.primary_report_number(payload)
+        invenio.publication_info_text(payload)
+        aliases = store.aliases_of_payload(backend, payload)
+    except Exception as e:  # one malformed record must not fail the chunk
+        logger.debug("record {} skipped: {}".format(record.get("recid"), e))
+        return None
+    return (payload, aliases) if aliases else None
+
+
+def normalize_chunk(backend, records):
+    # type: (str, List[dict]) -> List[Tuple[dict, List[str]]]
+    results = [normalize(backend, r) for r in records]
+    return [r for r in results if r is not None]
+
+
+def _chunks(records, size):
+    # type: (Iterator[dict], int) -> Iterator[List[dict]]
+    chunk = list()  # type: List[dict]
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def ingest(record_store, path, backend="ins", jobs=None, chunk_size=CHUNK_SIZE):
+    # type: (store.Store, str, str, Optional[int], int) -> Dict[str, int]
+    """Store the records in the dump file; return the numbers of records."""
+    if backend not in DATA_KEYS:
+        raise ValueError("records of {} cannot be ingested.".format(backend))
+    jobs = jobs or os.cpu_count() or 1
+    counts = {"records": 0, "stored": 0, "malformed": 0}
+    pending = deque()  # type: deque
+
+    def store_next():
+        counts["stored"] += record_store.save_many(backend, pending.popleft().result())
+
+    with open_dump(path) as f, ProcessPoolExecutor(max_workers=jobs) as executor:
+        for chunk in _chunks(iter_records(f, counts=counts), chunk_size):
+            counts["records"] += len(chunk)
+            pending.append(executor.submit(normalize_chunk, backend, chunk))
+            if len(pending) >= 2 * jobs:
+                store_next()
+        while pending:
+            store_next()
+    counts["skipped"] = counts["records"] - counts["stored"]
+    return counts
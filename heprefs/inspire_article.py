@@ -4,7 +4,11 @@ import os
 from logging import getLogger
 from typing import Tuple  # noqa: F401
 import json
+import heprefs.classify as classify
 import heprefs.invenio as invenio
+import heprefs.lock as lock
+import heprefs.profiling as profiling
+import heprefs.store as store
 
 try:
     from urllib import quote_plus  # type: ignore  # noqa
@@ -12,12 +16,13 @@ try:
 except ImportError:
     from urllib.parse import quote_plus
     from urllib.request import urlopen
+    from urllib.error import HTTPError
 
 logger = getLogger(__name__)
 
 
 class InspireArticle(object):
-    API = "https://inspirehep.net/search"
+    API = os.environ.get("HEPREFS_INSPIRE_API") or "https://inspirehep.net/search"
     RECORD_PATH = "http://inspirehep.net/record/"
     ARXIV_SERVER = "https://arxiv.org"
     DOI_SERVER = "https://dx.doi.org"
@@ -26,12 +31,13 @@ class InspireArticle(object):
         + "authors,corporate_name,title,abstract,publication_info,files"
     )
 
-    LIKELY_PATTERNS = [
-        r"^(doi:)?10\.\d{4,}/.*$",  # doi
-        r"^find? .+",  # old spires style
-    ]
+    CITATIONS_KEY = "number_of_citations"
+    CITATIONS_WITHOUT_SELF_KEY = "citation_count_without_self_citations"
+
+    LIKELY_PATTERNS = classify.INSPIRE_PATTERNS
 
     @classmethod
+    @profiling.profiled("get_info", "ins")
     def get_info(cls, query):
         query_url = "{}?p={}&of=recjson&ot={}&rg=3".format(
             cls.API, quote_plus(query), cls.DATA_KEY
@@ -43,7 +49,8 @@ class InspireArticle(object):
         except HTTPError as e:
             raise Exception("Failed to fetch inspireHEP information: " + e.__str__())
         try:
-            results = json.loads(s.decode("utf-8"))
+            with profiling.phase("parse", "ins"):
+                results = json.loads(s.decode("utf-8"))
         except Exception as e:
             raise Exception(
                 "parse failed; query {} to inspireHEP gives no result?: ".format(query)
@@ -68,7 +75,7 @@ class InspireArticle(object):
     @classmethod
     def try_to_construct(cls, query, force=False):
         if not force:
-            if not any(re.match(r, query) for r in cls.LIKELY_PATTERNS):
+            if classify.classify(query)[0] != "ins":
                 return False
         return cls(query)
 
@@ -79,9 +86,34 @@ class InspireArticle(object):
     @property
     def info(self):
         if not self._info:
-            self._info = self.get_info(self.query)
+            self._info = self.load_info()
         return self._info
 
+    def stored_info(self):
+        record = store.recall(self.query, "ins")
+        if record.get("ins"):
+            return record["ins"]
+        if record.get("cds"):
+            return invenio.foreign_payload(record["cds"])
+        if record.get("arxiv"):
+            return invenio.from_arxiv(record["arxiv"])
+        return None
+
+    def load_info(self):
+        info = self.stored_info()
+        if info:
+            return info
+        aliases = store.aliases_of_key(self.query, "ins")
+        if not aliases:
+            # results of general queries are not shared via the store.
+            return self.get_info(self.query)
+        with lock.single_flight("info", aliases[0]) as flight:
+            info = self.stored_info() if flight.waited else None
+            if not info:
+                info = self.get_info(self.query)
+                store.remember("ins", info)
+        return info
+
     def abs_url(self):
         # type: () -> str
         if "doi" in self.info:
@@ -1,7 +1,17 @@
 from logging import getLogger
-from typing import List, Mapping  # noqa: F401
+from typing import Iterable, Iterator, List, Mapping, Optional, Tuple  # noqa: F401
+import json
 import re
 import sys
+import heprefs.profiling as profiling
+
+try:
+    from urllib import quote_plus  # type: ignore  # noqa
+    from urllib2 import urlopen, HTTPError  # type: ignore  # noqa
+except ImportError:
+    from urllib.parse import quote_plus
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
 
 """
     Utilities to handle JSON output from INVENIO system (inspireHEP/CDS).
@@ -12,6 +22,9 @@ if sys.version_info[0] < 3:
     str = basestring  # noqa: F821
 logger = getLogger(__name__)
 
+MAX_QUERY_LENGTH = 1500  # of URL-encoded queries
+PAGE_SIZE = 200  # the maximum number of records per page of the servers
+
 
 def normalize_authors(json):
     # type: (dict) -> list
@@ -52,6 +65,14 @@ def flatten_author(a):
         return ""
 
 
+def first_last_name(a):
+    # type: (dict) -> str
+    """Return the name in "First Last" order even if only "Last, First" is given."""
+    if a.get("first_name") and a.get("last_name"):
+        return "{first_name} {last_name}".format(**a)
+    return " ".join(reversed((a.get("full_name") or "").split(", ", 1))).strip()
+
+
 def flatten_authors(json):
     # type: (dict) -> list
     return [flatten_author(a) for a in normalize_authors(json)]
@@ -174,3 +195,91 @@ def primary_report_number(json):
         )
     content = re.sub(r"^arXiv:", "", content, re.IGNORECASE)
     return content
+
+
+def _author_from_name(name):
+    # type: (str) -> dict
+    names = name.rsplit(" ", 1)
+    if len(names) < 2:
+        return {"full_name": name}
+    return {
+        "full_name": "{}, {}".format(names[1], names[0]),
+        "first_name": names[0],
+        "last_name": names[1],
+    }
+
+
+def from_arxiv(payload):
+    # type: (dict) -> dict
+    """Construct a minimal recjson dictionary from stored arXiv metadata."""
+    arxiv_id = re.sub(r"^.*/abs/|v\d+$", "", payload.get("entry_id") or "")
+    json = {
+        "title": {"title": payload.get("title") or ""},
+        "authors": [_author_from_name(a) for a in payload.get("authors") or []],
+        "primary_report_number": ["arXiv:" + arxiv_id] if arxiv_id else [],
+    }  # type: dict
+    if payload.get("doi"):
+        json["doi"] = payload["doi"]
+    return json
+
+
+def foreign_payload(json):
+    # type: (dict) -> dict
+    """Return a payload of the other Invenio server without its recid.
+
+    Record IDs are specific to each server, so they must not be used to
+    construct URLs of this server.
+    """
+    return dict((k, v) for k, v in json.items() if k != "recid")
+
+
+def chunked_queries(terms, template="{}"):
+    # type: (Iterable[str], str) -> Iterator[Tuple[str, List[str]]]
+    """Yield (query, terms), where query is the template filled with OR-joined terms.
+
+    Queries are chunked so that their URL-encoded lengths are below MAX_QUERY_LENGTH.
+    """
+    chunk = list()  # type: List[str]
+    for term in terms:
+        query = template.format(" or ".join(chunk + [term]))
+        if chunk and len(quote_plus(query)) > MAX_QUERY_LENGTH:
+            yield template.format(" or ".join(chunk)), chunk
+            chunk = list()
+        chunk.append(term)
+    if chunk:
+        yield template.format(" or ".join(chunk)), chunk
+
+
+def search(api, query, data_key, backend, size=PAGE_SIZE, max_records=None):
+    # type: (str, str, str, str, int, Optional[int]) -> Iterator[dict]
+    """Yield the records matching the query on the server of `api`.
+
+    Records are fetched by pages of `size` records; `backend` ("ins" or "cds")
+    names the phases of memory profiling.
+    """
+    size = min(size, PAGE_SIZE)
+    count = 0
+    while max_records is None or count < max_records:
+        query_url = "{}?p={}&of=recjson&ot={}&rg={}&jrec={}".format(
+            api, quote_plus(query), data_key, size, count + 1
+        )
+        try:
+            f = urlopen(query_url)  # "with" does not work on python2
+            s = f.read()
+            f.close()
+        except HTTPError as e:
+            raise Exception("Failed to search {}: ".format(api) + e.__str__())
+        try:
+            with profiling.phase("parse", backend):
+                page = json.loads(s.decode("utf-8")) if s.strip() else []
+        except Exception as e:
+            raise Exception(
+                "parse failed; query {} to {}: ".format(query, api) + e.__str__()
+            )
+        if not isinstance(page, list):
+            raise Exception("query {} to {} gives no list.".format(query, api))
+        for record in page:
+            yield record
+        count += len(page)
+        if len(page) < size:
+            break
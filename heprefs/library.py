@@ -0,0 +1,220 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple  # noqa: F401
+import hashlib
+import os
+import re
+import sqlite3
+import heprefs.classify as classify
+import heprefs.store as store
+
+"""
+    Index of local PDF files, mapping identifiers to paths.
+
+    Files are identified by names following `download_parameters()`, e.g.,
+    `1505.02996-Author1-Author2.pdf`, or otherwise by their SHA-1 digests
+    matched against files already identified.
+"""
+
+
+logger = getLogger(__name__)
+
+FILENAME_PATTERNS = [
+    re.compile(r"^(\d{4}\.\d{4,5})(v\d+)?(?:-.*)?\.pdf$"),
+    re.compile(r"^([a-z-]+(?:\.[A-Z]{2})?)(\d{7})(v\d+)?(?:-.*)?\.pdf$"),
+    re.compile(r"^([A-Za-z-]+-\d+-\d+)()(?:-.*)?\.pdf$"),
+]
+
+
+def identifier_of_key(key):
+    # type: (str) -> str
+    """Return the alias of the key, suffixed by the version for arXiv."""
+    aliases = store.aliases_of_key(key)
+    if not aliases:
+        return ""
+    t, normalized = classify.classify(key)
+    version = re.search(r"v\d+$", normalized) if t == "arxiv" else None
+    return aliases[0] + (version.group(0) if version else "")
+
+
+def identifier_of_filename(filename):
+    # type: (str) -> str
+    for pattern in FILENAME_PATTERNS:
+        m = pattern.match(filename)
+        if m:
+            # old arXiv IDs lose "/" in filenames; the last group is the version.
+            groups = m.groups()
+            return identifier_of_key("/".join(groups[:-1]) + (groups[-1] or ""))
+    return ""
+
+
+def sha1sum(path):
+    # type: (str) -> str
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _sha1sum_or_empty(path):
+    # type: (str) -> str
+    try:
+        return sha1sum(path)
+    except (IOError, OSError):
+        return ""
+
+
+class Library(object):
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS library (path TEXT PRIMARY KEY, mtime REAL, "
+        + "inode INTEGER, size INTEGER, identifier TEXT, sha1 TEXT)",
+        "CREATE INDEX IF NOT EXISTS library_identifier ON library (identifier)",
+        "CREATE INDEX IF NOT EXISTS library_sha1 ON library (sha1)",
+    ]
+
+    def __init__(self, record_store):
+        # type: (store.Store) -> None
+        self.store = record_store
+        self.db = record_store.db
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+    def scan(self, directory, jobs=None):
+        # type: (str, Optional[int]) -> Dict[str, int]
+        """Index PDF files under the directory; unchanged files are skipped."""
+        directory = os.path.abspath(directory)
+        prefix = os.path.join(directory, "")
+        known = dict(
+            (row[0], tuple(row[1:]))
+            for row in self.db.execute(
+                "SELECT path, mtime, inode, size FROM library "
+                + "WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+        )  # type: Dict[str, Tuple[float, int, int]]
+
+        rows = list()  # type: List[List]
+        seen = set()
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                signature = (stat.st_mtime, stat.st_ino, stat.st_size)
+                if known.get(path) == signature:
+                    continue
+                rows.append(
+                    [path] + list(signature) + [identifier_of_filename(name), ""]
+                )
+
+        # named files are also hashed so that their copies with other names
+        # are identified.
+        if rows:
+            from concurrent.futures import ProcessPoolExecutor  # slow to import
+
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                digests = executor.map(
+                    _sha1sum_or_empty,
+                    [r[0] for r in rows],
+                    chunksize=max(1, len(rows) // 64),
+                )
+                for row, digest in zip(rows, digests):
+                    row[5] = digest
+        unnamed = [r for r in rows if not r[4]]
+
+        removed = [p for p in known if p not in seen]
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self.db.executemany(
+                "DELETE FROM library WHERE path = ?", [(p,) for p in removed]
+            )
+            # identify files whose contents are already known under other names
+            matched = self.db.execute(
+                "UPDATE library SET identifier = (SELECT known.identifier "
+                + "FROM library AS known WHERE known.sha1 = library.sha1 "
+                + "AND known.identifier != '' LIMIT 1) "
+                + "WHERE identifier = '' AND sha1 != '' AND EXISTS (SELECT 1 "
+                + "FROM library AS known WHERE known.sha1 = library.sha1 "
+                + "AND known.identifier != '')"
+            ).rowcount
+        self.store.modified = True
+        self.store.modified_ids = None  # removed files are not known individually
+        return {
+            "files": len(seen),
+            "updated": len(rows),
+            "removed": len(removed),
+            "hashed": len([r for r in rows if r[5]]),
+            "identified": len(rows) - len(unnamed) + matched,
+        }
+
+    def register(self, path, identifier):
+        # type: (str, str) -> None
+        """Add a file, e.g., just downloaded, with the known identifier."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    stat.st_mtime,
+                    stat.st_ino,
+                    stat.st_size,
+                    identifier,
+                    sha1sum(path),
+                ),
+            )
+        self.store.modified = True
+
+    def find(self, identifiers):
+        # type: (List[str]) -> str
+        """Return the path of an existing file with any of the identifiers."""
+        for identifier in identifiers:
+            rows = self.db.execute(
+                "SELECT path FROM library WHERE identifier = ?", (identifier,)
+            ).fetchall()
+            for (path,) in rows:
+                if os.path.isfile(path):
+                    return path
+        return ""
+
+
+def local_copy(key):
+    # type: (str) -> str
+    """Return the path of a local PDF file for the key, or an empty string."""
+    record_store = store.default_store()
+    if record_store is None:
+        return ""
+    identifiers = [identifier_of_key(key)]
+    if not identifiers[0]:
+        return ""
+    elif identifiers[0] not in store.aliases_of_key(key):
+        # versioned arXiv key; only files of the version are used.
+        return Library(record_store).find(identifiers)
+    canonical = record_store.canonical_id(key)
+    if canonical:
+        identifiers += record_store.aliases(canonical)
+    return Library(record_store).find(identifiers)
+
+
+def register_download(path, key):
+    # type: (str, str) -> None
+    record_store = store.default_store()
+    identifier = identifier_of_filename(os.path.basename(path)) or identifier_of_key(
+        key
+    )
+    if record_store is None or not identifier:
+        return
+    try:
+        Library(record_store).register(path, identifier)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("failed to register {}: {}".format(path, e))
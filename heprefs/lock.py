@@ -0,0 +1,66 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from logging import getLogger
+from typing import IO, Optional  # noqa: F401
+import hashlib
+import os
+import heprefs.store as store
+
+try:
+    import fcntl
+except ImportError:  # e.g., on Windows; processes are not coordinated.
+    fcntl = None  # type: ignore
+
+"""
+    File locks to coordinate concurrent heprefs processes ("single flight").
+
+    The first process to take the lock does the work (fetching or downloading);
+    the others wait for the lock, and then find `waited` set so that they can
+    use the result instead of repeating the work.
+"""
+
+
+logger = getLogger(__name__)
+
+
+def lock_dir():
+    # type: () -> str
+    return os.path.join(os.path.dirname(store.default_path()), "locks")
+
+
+class SingleFlight(object):
+    def __init__(self, kind, name):
+        # type: (str, str) -> None
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        self.path = os.path.join(lock_dir(), "{}-{}.lock".format(kind, digest))
+        self.waited = False
+        self._file = None  # type: Optional[IO[str]]
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            if not os.path.isdir(lock_dir()):
+                os.makedirs(lock_dir())
+            self._file = open(self.path, "a")
+        except (IOError, OSError) as e:
+            logger.debug("lock is not available: " + e.__str__())
+            return self
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self.waited = True
+            logger.debug("waiting for another process: " + self.path)
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
+
+
+def single_flight(kind, name):
+    # type: (str, str) -> SingleFlight
+    return SingleFlight(kind, name)
@@ -0,0 +1,178 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple  # noqa: F401
+import re
+import heprefs.classify as classify
+import heprefs.invenio as invenio
+import heprefs.store as store
+from heprefs.inspire_article import InspireArticle
+
+"""
+    Citation metrics of inspireHEP records.
+
+    Records are resolved and their citation counts are fetched by queries of
+    OR-joined terms, each of which is chunked to keep URLs short, so that many
+    papers cost only a few requests.
+"""
+
+
+logger = getLogger(__name__)
+
+
+def _stored_recid(key):
+    # type: (str) -> Optional[int]
+    record_store = store.default_store()
+    canonical = record_store.canonical_id(key, "ins") if record_store else None
+    if canonical:
+        for alias in record_store.aliases(canonical):  # type: ignore
+            if alias.startswith("ins:"):
+                return int(alias[4:])
+    return None
+
+
+def resolve_recids(keys):
+    # type: (Iterable[str]) -> Tuple[Dict[str, int], List[str]]
+    """Return inspireHEP recids of the keys, and the list of unresolved keys."""
+    keys = list(keys)
+    recids = OrderedDict()  # type: Dict[str, int]
+    # term -> keys, as keys with and without versions give the same term
+    batches = {
+        "eprint": OrderedDict(),
+        "doi": OrderedDict(),
+    }  # type: Dict[str, Dict[str, List[str]]]
+    singles = list()  # type: List[str]
+    for key in keys:
+        recid = _stored_recid(key)
+        if recid is not None:
+            recids[key] = recid
+            continue
+        t, normalized = classify.classify(key)
+        doi = re.match(r"^(?:doi:)?(10\.\d{4,}/.*)$", key, flags=re.IGNORECASE)
+        if t == "arxiv":
+            term = re.sub(r"v\d+$", "", normalized)
+            batches["eprint"].setdefault(term, list()).append(key)
+        elif doi:
+            batches["doi"].setdefault(doi.group(1).lower(), list()).append(key)
+        else:
+            singles.append(key)
+
+    for field, terms in batches.items():
+        for query, chunk in invenio.chunked_queries(
+            ["{} {}".format(field, t) for t in terms], template="find {}"
+        ):
+            results = invenio.search(
+                InspireArticle.API,
+                query,
+                InspireArticle.DATA_KEY + ",doi",
+                "ins",
+                size=len(chunk),
+                max_records=len(chunk),
+            )
+            for result in results:
+                store.remember("ins", result)
+                if field == "eprint":
+                    identifiers = [invenio.arxiv_id(result)]
+                else:
+                    identifiers = [d.lower() for d in store.as_list(result.get("doi"))]
+                for i in identifiers:
+                    if result.get("recid"):
+                        for key in terms.get(i, []):
+                            recids[key] = int(result["recid"])
+
+    for key in singles:
+        try:
+            info = InspireArticle(key).info
+        except Exception as e:
+            logger.debug("failed to resolve {}: {}".format(key, e))
+            continue
+        if info.get("recid"):
+            recids[key] = int(info["recid"])
+
+    unresolved = [k for k in keys if k not in recids]
+    return recids, unresolved
+
+
+def _row(key, result, self_citations):
+    # type: (str, dict, bool) -> Dict[str, Any]
+    row = OrderedDict(
+        [
+            ("key", key),
+            ("recid", int(result.get("recid") or 0)),
+            ("citations", int(result.get(InspireArticle.CITATIONS_KEY) or 0)),
+        ]
+    )  # type: Dict[str, Any]
+    if self_citations:
+        row["citations_without_self"] = int(
+            result.get(InspireArticle.CITATIONS_WITHOUT_SELF_KEY) or 0
+        )
+    row["title"] = re.sub(r"\s+", " ", invenio.title(result))
+    return row
+
+
+def _data_key(self_citations):
+    # type: (bool) -> str
+    keys = ["recid", "title", "primary_report_number", InspireArticle.CITATIONS_KEY]
+    if self_citations:
+        keys.append(InspireArticle.CITATIONS_WITHOUT_SELF_KEY)
+    return ",".join(keys)
+
+
+def citation_rows(recids, self_citations=False):
+    # type: (Dict[str, int], bool) -> Iterator[Dict[str, Any]]
+    """Yield a row of citation counts for each key, fetched by batches."""
+    keys_of = OrderedDict()  # type: Dict[int, List[str]]
+    for key, recid in recids.items():
+        keys_of.setdefault(recid, list()).append(key)
+    for query, chunk in invenio.chunked_queries(
+        ["recid:{}".format(r) for r in keys_of]
+    ):
+        results = invenio.search(
+            InspireArticle.API,
+            query,
+            _data_key(self_citations),
+            "ins",
+            size=len(chunk),
+            max_records=len(chunk),
+        )
+        for result in results:
+            for key in keys_of.get(int(result.get("recid") or 0), []):
+                yield _row(key, result, self_citations)
+
+
+def query_rows(query, self_citations=False):
+    # type: (str, bool) -> Iterator[Dict[str, Any]]
+    """Yield a row of citation counts for each record matching the query."""
+    results = invenio.search(
+        InspireArticle.API, query, _data_key(self_citations), "ins"
+    )
+    for result in results:
+        try:
+            number = invenio.primary_report_number(result)
+        except (ValueError, IndexError):  # e.g., an empty list
+            number = ""
+        yield _row(number or str(result.get("recid")), result, self_citations)
+
+
+def h_index(counts):
+    # type: (Iterable[int]) -> int
+    counts = sorted(counts, reverse=True)
+    return max([i + 1 for i, c in enumerate(counts) if c >= i + 1] or [0])
+
+
+def summary(rows, self_citations=False):
+    # type: (Iterable[Dict[str, Any]], bool) -> Dict[str, int]
+    """Return totals and h-indices; papers appearing twice are counted once."""
+    unique = OrderedDict((r["recid"], r) for r in rows)
+    result = OrderedDict(
+        [
+            ("papers", len(unique)),
+            ("citations", sum(r["citations"] for r in unique.values())),
+            ("h_index", h_index(r["citations"] for r in unique.values())),
+        ]
+    )  # type: Dict[str, int]
+    if self_citations:
+        counts = [r["citations_without_self"] for r in unique.values()]
+        result["citations_without_self"] = sum(counts)
+        result["h_index_without_self"] = h_index(counts)
+    return result
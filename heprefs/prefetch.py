@@ -0,0 +1,238 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+from logging import getLogger
+from typing import Any, Dict, List, Tuple  # noqa: F401
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import heprefs.library as library
+import heprefs.lock as lock
+import heprefs.store as store
+
+try:
+    from urllib2 import urlopen  # type: ignore  # noqa
+except ImportError:
+    from urllib.request import urlopen
+
+"""
+    Speculative prefetch of files likely to be requested next.
+
+    After `abs` or `short_info`, a detached worker process downloads the PDF
+    file (and, for arXiv, the source tarball) into the cache directory, so
+    that a later `get` or `source` is answered from the local disk.  This is
+    disabled unless configured by environment variables:
+
+        HEPREFS_PREFETCH             artifacts to prefetch, e.g., "pdf,source"
+        HEPREFS_PREFETCH_MAX_SIZE    size limit of each file in MB (default 50)
+        HEPREFS_PREFETCH_RATE        bandwidth limit in kB/s (default unlimited)
+        HEPREFS_PREFETCH_CACHE_SIZE  total size of prefetched files in MB
+                                     (default 1000); oldest files are removed
+
+    Each of them but the cache size, which limits the files of all backends
+    together, can be overridden per backend by appending "_ARXIV", "_INS", or
+    "_CDS", e.g., HEPREFS_PREFETCH_CDS=none.
+"""
+
+
+logger = getLogger(__name__)
+
+ARTIFACTS = ["pdf", "source"]
+DEFAULT_MAX_SIZE = 50.0  # MB
+DEFAULT_CACHE_SIZE = 1000.0  # MB
+READ_SIZE = 1 << 16
+
+Policy = namedtuple("Policy", ["artifacts", "max_size", "rate"])
+
+
+def _env(name, backend):
+    # type: (str, str) -> str
+    value = os.environ.get("{}_{}".format(name, backend.upper())) if backend else None
+    return os.environ.get(name, "") if value is None else value
+
+
+def _number(name, backend, default):
+    # type: (str, str, float) -> float
+    try:
+        return float(_env(name, backend) or default)
+    except ValueError:
+        logger.warning("{} is not a number; {} is used.".format(name, default))
+        return default
+
+
+def policy(backend):
+    # type: (str) -> Policy
+    """Return the prefetch policy of the backend; sizes are in bytes."""
+    artifacts = re.split(r"[\s,]+", _env("HEPREFS_PREFETCH", backend).lower())
+    return Policy(
+        artifacts=[a for a in ARTIFACTS if a in artifacts],
+        max_size=int(
+            _number("HEPREFS_PREFETCH_MAX_SIZE", backend, DEFAULT_MAX_SIZE) * 1e6
+        ),
+        rate=_number("HEPREFS_PREFETCH_RATE", backend, 0) * 1e3,
+    )
+
+
+def files_dir():
+    # type: () -> str
+    return os.path.join(os.path.dirname(store.default_path()), "files")
+
+
+def _safe(filename):
+    # type: (str) -> str
+    return re.sub(r'[\\/*?:"<>|]', "", filename)
+
+
+def _backend(article):
+    # type: (Any) -> str
+    from heprefs.api import type_of
+
+    return type_of(article)
+
+
+def targets(article, artifacts):
+    # type: (Any, List[str]) -> Dict[str, Tuple[str, str]]
+    """Return {artifact: (url, path)} of the artifacts available for the article."""
+    result = dict()  # type: Dict[str, Tuple[str, str]]
+    if "pdf" in artifacts:
+        url, filename = article.download_parameters()
+        if url:
+            result["pdf"] = (url, os.path.join(files_dir(), _safe(filename)))
+    if "source" in artifacts and _backend(article) == "arxiv":
+        filename = "{}.tar.gz".format(article.versioned_id())
+        result["source"] = (
+            article.source_url(),
+            os.path.join(files_dir(), _safe(filename)),
+        )
+    return result
+
+
+def prefetched(article, artifact):
+    # type: (Any, str) -> str
+    """Return the path of the prefetched file, waiting for a running worker."""
+    target = targets(article, [artifact]).get(artifact)
+    if not target:
+        return ""
+    with lock.single_flight("download", target[1]):
+        pass
+    return target[1] if os.path.isfile(target[1]) else ""
+
+
+def schedule(article, key):
+    # type: (Any, str) -> bool
+    """Start a detached worker to prefetch files for the article, if configured."""
+    backend = _backend(article)
+    p = policy(backend)
+    if not p.artifacts:
+        return False
+    jobs = list()  # type: List[Dict[str, Any]]
+    for artifact, (url, path) in targets(article, p.artifacts).items():
+        if os.path.isfile(path):
+            continue
+        if artifact == "pdf" and library.local_copy(key):
+            continue
+        jobs.append(
+            dict(
+                url=url,
+                path=path,
+                key=key if artifact == "pdf" else "",
+                max_size=p.max_size,
+                rate=p.rate,
+            )
+        )
+    if not jobs:
+        return False
+
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package_root] + [v for v in [env.get("PYTHONPATH")] if v]
+    )
+    subprocess.Popen(
+        [sys.executable, "-m", "heprefs.prefetch", json.dumps(jobs)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+        close_fds=True,
+        start_new_session=True,
+    )
+    logger.debug("prefetching " + ", ".join(j["url"] for j in jobs))
+    return True
+
+
+def fetch(url, path, max_size=0, rate=0.0):
+    # type: (str, str, int, float) -> bool
+    """Download within the size limit (bytes) and the rate (bytes per second)."""
+    with lock.single_flight("download", path):
+        if os.path.isfile(path):
+            return False
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        part = path + ".part"
+        f = urlopen(url)
+        try:
+            length = int(f.headers.get("Content-Length") or 0)
+            if max_size and length > max_size:
+                logger.debug("{} is too large ({} bytes).".format(url, length))
+                return False
+            size, started = (0, time.time())
+            with open(part, "wb") as out:
+                for chunk in iter(lambda: f.read(READ_SIZE), b""):
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        logger.debug("{} exceeds the size limit.".format(url))
+                        return False
+                    out.write(chunk)
+                    if rate:
+                        time.sleep(max(0, size / rate - (time.time() - started)))
+            os.replace(part, path)
+            return True
+        finally:
+            f.close()
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def evict(cache_size):
+    # type: (float) -> int
+    """Remove the oldest prefetched files beyond the total size; return the number."""
+    try:
+        names = [n for n in os.listdir(files_dir()) if not n.endswith(".part")]
+    except OSError:
+        return 0
+    files = list()
+    for name in names:
+        path = os.path.join(files_dir(), name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort(reverse=True)
+    total, removed = (0, 0)
+    for _, size, path in files:
+        total += size
+        if total > cache_size:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main(jobs):
+    # type: (List[Dict[str, Any]]) -> None
+    for job in jobs:
+        try:
+            fetched = fetch(job["url"], job["path"], job["max_size"], job["rate"])
+        except Exception as e:
+            logger.debug("prefetch of {} failed: {}".format(job["url"], e))
+            continue
+        if fetched and job["key"]:
+            library.register_download(job["path"], job["key"])
+    evict(_number("HEPREFS_PREFETCH_CACHE_SIZE", "", DEFAULT_CACHE_SIZE) * 1e6)
+
+
+if __name__ == "__main__":
+    main(json.loads(sys.argv[1]))
@@ -0,0 +1,256 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple  # noqa: F401
+import functools
+import json
+import threading
+import tracemalloc
+
+"""
+    Memory profiling of lookups by tracemalloc.
+
+    Phases ("get_info", "parse", and "render") are marked in the backends and
+    the command-line interface by `phase` or `profiled`, which do nothing
+    unless `enable` is called, e.g., by `heprefs --profile-memory`.  For each
+    backend and phase, `report` gives the number of calls, the peak of traced
+    memory above the level at the start, the memory retained after the phase,
+    and the lines allocating most of the retained memory.
+
+    Phases nested in others are included in the outer ones.  If lookups run
+    concurrently (e.g., `api.resolve_many`), peaks of phases include
+    allocations by the other threads, and the total peak is the figure to
+    size worker pools with.
+"""
+
+
+TOP_SITES = 10
+
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+]
+_lock = threading.Lock()
+_local = threading.local()
+_profile = None  # type: Optional[_Profile]
+
+
+class _Stats(object):
+    def __init__(self):
+        # type: () -> None
+        self.calls = 0
+        self.peak = 0
+        self.peak_sum = 0
+        self.retained = 0
+        self.sites = dict()  # type: Dict[str, List[int]]
+
+    def add(self, peak, retained, sites):
+        # type: (int, int, List[Tuple[str, int, int]]) -> None
+        self.calls += 1
+        self.peak = max(self.peak, peak)
+        self.peak_sum += peak
+        self.retained += retained
+        for site, size, count in sites:
+            total = self.sites.setdefault(site, [0, 0])
+            total[0] += size
+            total[1] += count
+
+    def as_dict(self, top):
+        # type: (int) -> Dict[str, Any]
+        sites = sorted(self.sites.items(), key=lambda s: -s[1][0])[:top]
+        return OrderedDict(
+            [
+                ("calls", self.calls),
+                ("peak", self.peak),
+                ("mean_peak", self.peak_sum // max(1, self.calls)),
+                ("retained", self.retained),
+                ("retained_per_call", self.retained // max(1, self.calls)),
+                (
+                    "top",
+                    [
+                        OrderedDict([("site", s), ("size", v[0]), ("count", v[1])])
+                        for s, v in sites
+                    ],
+                ),
+            ]
+        )
+
+
+class _Profile(object):
+    def __init__(self, top):
+        # type: (int) -> None
+        self.top = top
+        self.active = 0  # number of phases running in all threads
+        self.peak = 0  # before the last reset of the peak
+        self.stats = OrderedDict()  # type: Dict[Tuple[str, str], _Stats]
+
+    def observe(self, running):
+        # type: (Optional[_Phase]) -> None
+        """Keep the peak so far in the profile and the running phase."""
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak = max(self.peak, peak)
+        if running is not None:
+            running.peak = max(running.peak, peak)
+
+
+def _stack():
+    # type: () -> List[_Phase]
+    if not hasattr(_local, "stack"):
+        _local.stack = list()
+    return _local.stack
+
+
+def _reset_peak():
+    # type: () -> None
+    if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+        tracemalloc.reset_peak()
+
+
+class _Phase(object):
+    def __init__(self, profile, name, backend):
+        # type: (_Profile, str, str) -> None
+        self.profile = profile
+        self.name = name
+        self.backend = backend
+        self.start = 0
+        self.peak = 0
+        self.snapshot = None  # type: Optional[tracemalloc.Snapshot]
+
+    def __enter__(self):
+        stack = _stack()
+        with _lock:
+            # the peak is measured from here if no phase is running in other
+            # threads; otherwise it is an upper bound.
+            alone = self.profile.active == len(stack)
+            if alone:
+                self.profile.observe(stack[-1] if stack else None)
+            self.profile.active += 1
+            if self.profile.top:
+                self.snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+            if alone:
+                _reset_peak()  # not to count the snapshot
+            self.start = self.peak = tracemalloc.get_traced_memory()[0]
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = _stack()
+        stack.pop()
+        with _lock:
+            self.profile.active -= 1
+            alone = self.profile.active == len(stack)
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            self.profile.peak = max(self.profile.peak, peak)
+            retained, sites = self._diff(current - self.start)
+            key = (self.backend, self.name)
+            if key not in self.profile.stats:
+                self.profile.stats[key] = _Stats()
+            self.profile.stats[key].add(self.peak - self.start, retained, sites)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            if alone:
+                _reset_peak()
+        return False
+
+    def _diff(self, retained):
+        # type: (int) -> Tuple[int, List[Tuple[str, int, int]]]
+        """Return the retained size and (line, size, count) of top allocations.
+
+        With snapshots, allocations by tracemalloc and this module are excluded.
+        """
+        if self.snapshot is None:
+            return retained, []
+        snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        diffs = snapshot.compare_to(self.snapshot, "lineno")
+        self.snapshot = None
+        return (
+            sum(d.size_diff for d in diffs),
+            [
+                (str(d.traceback), d.size_diff, d.count_diff)
+                for d in diffs[: self.profile.top]
+                if d.size_diff > 0
+            ],
+        )
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def enable(top=TOP_SITES):
+    # type: (int) -> None
+    """Start tracing; `top` allocation sites are kept for each phase (0 for none)."""
+    global _profile
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _profile = _Profile(top)
+
+
+def disable():
+    # type: () -> None
+    global _profile
+    _profile = None
+    tracemalloc.stop()
+
+
+def enabled():
+    # type: () -> bool
+    return _profile is not None
+
+
+def phase(name, backend):
+    """Return a context manager to profile a phase of the backend, if enabled."""
+    profile = _profile
+    return _NULL_PHASE if profile is None else _Phase(profile, name, backend)
+
+
+def profiled(name, backend):
+    # type: (str, str) -> Callable
+    """Decorator to profile calls of the function as a phase, if enabled."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return func(*args, **kwargs)
+            with phase(name, backend):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def report():
+    # type: () -> Dict[str, Any]
+    """Return the profile: total memory and statistics of each backend and phase."""
+    profile = _profile
+    if profile is None:
+        return dict()
+    with _lock:
+        current, peak = tracemalloc.get_traced_memory()
+        phases = [
+            OrderedDict(
+                [("backend", b), ("phase", p)] + list(s.as_dict(profile.top).items())
+            )
+            for (b, p), s in profile.stats.items()
+        ]
+    return OrderedDict(
+        [
+            ("peak", max(profile.peak, peak)),
+            ("current", current),
+            ("phases", phases),
+        ]
+    )
+
+
+def dumps_report():
+    # type: () -> str
+    return json.dumps(report(), indent=2)
@@ -0,0 +1,87 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from logging import getLogger
+from typing import Optional, Tuple  # noqa: F401
+import time
+import heprefs.invenio as invenio
+import heprefs.store as store
+from heprefs.arxiv_article import ArxivArticle
+from heprefs.cds_article import CDSArticle
+from heprefs.inspire_article import InspireArticle
+
+"""
+    Revalidation of the records in the local store.
+
+    Invenio (inspireHEP/CDS) records are re-fetched only if modified since the
+    last sync, which is asked by batched date-modified queries of recids.
+    arXiv records are compared with the latest versions by batched id_list queries.
+"""
+
+
+logger = getLogger(__name__)
+
+INVENIO_APIS = {"ins": InspireArticle.API, "cds": CDSArticle.API}
+DATA_KEYS = {"ins": InspireArticle.DATA_KEY, "cds": CDSArticle.DATA_KEY}
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def _meta_key(backend):
+    # type: (str) -> str
+    return "last_sync_" + backend
+
+
+def last_sync(record_store, backend):
+    # type: (store.Store, str) -> Optional[float]
+    value = record_store.get_meta(_meta_key(backend))
+    return float(value) if value else record_store.oldest_update()
+
+
+def refresh_invenio(record_store, backend, since=None):
+    # type: (store.Store, str, Optional[str]) -> Tuple[int, int]
+    """Update the records modified since the date; return (checked, updated)."""
+    recids = record_store.recids(backend)
+    if not recids:
+        return 0, 0
+    started = time.time()
+    if since is None:
+        # one more day is searched as the server may be in another time zone.
+        last = last_sync(record_store, backend) or started
+        since = time.strftime(DATE_FORMAT, time.gmtime(last - 86400))
+
+    template = "datemodified:{}->9999-12-31 and ({{}})".format(since)
+    updated = 0
+    for query, chunk in invenio.chunked_queries(
+        ["recid:{}".format(r) for r in recids], template=template
+    ):
+        results = invenio.search(
+            INVENIO_APIS[backend],
+            query,
+            DATA_KEYS[backend],
+            backend,
+            size=len(chunk),
+            max_records=len(chunk),
+        )
+        for result in results:
+            record_store.save(backend, result)
+            updated += 1
+    record_store.set_meta(_meta_key(backend), str(started))
+    return len(recids), updated
+
+
+def refresh_arxiv(record_store):
+    # type: (store.Store) -> Tuple[int, int]
+    """Update the records with new versions; return (checked, updated)."""
+    stored = dict(
+        (store.arxiv_alias(entry_id), entry_id)
+        for entry_id in record_store.arxiv_entry_ids()
+    )
+    stored.pop("", None)
+    if not stored:
+        return 0, 0
+    started = time.time()
+    updated = 0
+    for result in ArxivArticle.get_infos([alias[6:] for alias in stored]):
+        if stored.get(store.arxiv_alias(result.entry_id)) != result.entry_id:
+            record_store.save("arxiv", ArxivArticle.info_to_payload(result))
+            updated += 1
+    record_store.set_meta(_meta_key("arxiv"), str(started))
+    return len(stored), updated
@@ -0,0 +1,340 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from logging import getLogger
+from typing import Dict, Iterable, List, Optional, Set, Tuple  # noqa: F401
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import heprefs.classify as classify
+import heprefs.profiling as profiling
+
+"""
+    Local record store shared by all backends.
+
+    Records fetched by any backend are kept under one canonical ID, and every
+    identifier found in the record (arXiv ID, DOI, recid, report number, ...)
+    is registered as an alias of the canonical ID.  A later lookup with any of
+    those identifiers is answered locally, whichever backend is used.
+"""
+
+
+if sys.version_info[0] < 3:
+    str = basestring  # noqa: F821
+logger = getLogger(__name__)
+
+BACKENDS = ["arxiv", "ins", "cds"]
+ALIAS_PRIORITY = ["arxiv", "doi", "ins", "cds", "report"]  # for canonical IDs
+
+_ARXIV_URL = re.compile(r"^https?://[^/]*arxiv\.org/(?:abs|pdf)/(.+?)(?:\.pdf)?$")
+_DOI = re.compile(r"^(?:doi:)?(10\.\d{4,}/\S+)$", flags=re.IGNORECASE)
+_FIND = re.compile(r"^find? +(eprint|arxiv|doi|recid|r|rept) +(\S+)$", re.IGNORECASE)
+
+
+def default_path():
+    # type: () -> str
+    cache_dir = os.environ.get("HEPREFS_CACHE_DIR") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "heprefs"
+    )
+    return os.path.join(cache_dir, "store.sqlite3")
+
+
+def arxiv_alias(i):
+    # type: (str) -> str
+    i = re.sub(r"^arxiv:", "", i.strip(), flags=re.IGNORECASE)
+    m = _ARXIV_URL.match(i)
+    try:
+        return "arxiv:" + classify.normalize_arxiv_id(m.group(1) if m else i)[0]
+    except ValueError:
+        return ""
+
+
+def aliases_of_key(key, backend=None):
+    # type: (str, Optional[str]) -> List[str]
+    """Return the aliases that a user-given key stands for (maybe empty).
+
+    Recids ("find recid N") are specific to the Invenio backend, without which
+    they give no aliases.
+    """
+    key = key.strip()
+    find = _FIND.match(key)
+    if find:
+        (field, value) = (find.group(1).lower(), find.group(2))
+        if field in ["eprint", "arxiv"]:
+            alias = arxiv_alias(value)
+            return [alias] if alias else []
+        elif field == "doi":
+            return aliases_of_key(value if _DOI.match(value) else "doi:" + value)
+        elif field == "recid":
+            return [backend + ":" + value] if backend in ["ins", "cds"] else []
+        else:
+            return ["report:" + value.upper()]
+
+    alias = arxiv_alias(key)
+    if alias:
+        return [alias]
+    doi = _DOI.match(key)
+    if doi:
+        return ["doi:" + doi.group(1).lower()]
+    if classify.classify(key)[0] == "cds":
+        return ["report:" + key.upper()]
+    return []
+
+
+def as_list(value):
+    # type: (object) -> list
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def aliases_of_payload(backend, payload):
+    # type: (str, dict) -> List[str]
+    """Return all identifiers found in the payload stored by the backend."""
+    aliases = list()  # type: List[str]
+    if backend == "arxiv":
+        aliases.append(arxiv_alias(payload.get("entry_id") or ""))
+        if payload.get("doi"):
+            aliases.append("doi:" + payload["doi"].lower())
+    else:
+        if payload.get("recid"):
+            aliases.append("{}:{}".format(backend, payload["recid"]))
+        for doi in as_list(payload.get("doi")):
+            if isinstance(doi, str) and doi:
+                aliases.append("doi:" + doi.lower())
+        for number in as_list(payload.get("primary_report_number")):
+            if not isinstance(number, str) or not number:
+                continue
+            alias = arxiv_alias(number) if number.startswith("arXiv:") else ""
+            aliases.append(alias or "report:" + number.upper())
+    aliases = [a for a in aliases if a]
+    aliases.sort(key=lambda a: ALIAS_PRIORITY.index(a.split(":", 1)[0]))
+    return aliases
+
+
+class Store(object):
+    """
+    SQLite-backed store of records.
+
+    A record is a dictionary mapping each backend name ("arxiv", "ins", "cds")
+    to the payload fetched by the backend, i.e., the dictionary of `arxiv.Result`
+    fields for arXiv and the recjson dictionary for Invenio.
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, data TEXT, updated REAL)",
+        "CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, id TEXT)",
+        "CREATE INDEX IF NOT EXISTS aliases_id ON aliases (id)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    ]
+
+    def __init__(self, path=None):
+        # type: (Optional[str]) -> None
+        self.path = path or default_path()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.modified = False
+        # canonical IDs of the records saved; None if unknown, e.g., after save_many
+        self.modified_ids = set()  # type: Optional[Set[str]]
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+    def close(self):
+        # type: () -> None
+        self.db.close()
+
+    def canonical_id(self, key, backend=None):
+        # type: (str, Optional[str]) -> Optional[str]
+        for alias in aliases_of_key(key, backend):
+            row = self.db.execute(
+                "SELECT id FROM aliases WHERE alias = ?", (alias,)
+            ).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def get(self, canonical):
+        # type: (str) -> Dict[str, dict]
+        row = self.db.execute(
+            "SELECT data FROM records WHERE id = ?", (canonical,)
+        ).fetchone()
+        if not row:
+            return dict()
+        with profiling.phase("parse", "store"):
+            return json.loads(row[0])
+
+    def find(self, key, backend=None):
+        # type: (str, Optional[str]) -> Dict[str, dict]
+        canonical = self.canonical_id(key, backend)
+        return self.get(canonical) if canonical else dict()
+
+    def aliases(self, canonical):
+        # type: (str) -> List[str]
+        rows = self.db.execute("SELECT alias FROM aliases WHERE id = ?", (canonical,))
+        return sorted(r[0] for r in rows)
+
+    def recids(self, backend):
+        # type: (str) -> List[int]
+        """Return the recids of the records stored by the Invenio backend."""
+        prefix = backend + ":"
+        rows = self.db.execute(
+            "SELECT alias FROM aliases WHERE substr(alias, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        return [int(r[0][len(prefix) :]) for r in rows]
+
+    def arxiv_entry_ids(self):
+        # type: () -> List[str]
+        """Return the versioned entry IDs of the stored arXiv payloads."""
+        rows = self.db.execute(
+            "SELECT json_extract(data, '$.arxiv.entry_id') FROM records "
+            + "WHERE json_extract(data, '$.arxiv.entry_id') IS NOT NULL"
+        )
+        return [r[0] for r in rows]
+
+    def oldest_update(self):
+        # type: () -> Optional[float]
+        return self.db.execute("SELECT min(updated) FROM records").fetchone()[0]
+
+    def get_meta(self, key):
+        # type: (str) -> Optional[str]
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        # type: (str, str) -> None
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def save(self, backend, payload):
+        # type: (str, dict) -> str
+        """Store the payload and return the canonical ID of the record."""
+        if backend not in BACKENDS:
+            raise ValueError("unknown backend: {}".format(backend))
+        aliases = aliases_of_payload(backend, payload)
+        if not aliases:
+            raise ValueError("record without any identifier cannot be stored.")
+        with self.db:
+            canonical = self._save(backend, payload, aliases)
+        self.modified = True
+        if self.modified_ids is not None:
+            self.modified_ids.add(canonical)
+        return canonical
+
+    def save_many(self, backend, items):
+        # type: (str, Iterable[Tuple[dict, List[str]]]) -> int
+        """Store (payload, aliases) pairs in one transaction; return the number saved.
+
+        Aliases must be given as `aliases_of_payload` would return; items
+        without aliases are skipped.
+        """
+        if backend not in BACKENDS:
+            raise ValueError("unknown backend: {}".format(backend))
+        saved = 0
+        with self.db:
+            for payload, aliases in items:
+                if aliases:
+                    self._save(backend, payload, aliases)
+                    saved += 1
+        self.modified = True
+        self.modified_ids = None
+        return saved
+
+    def _save(self, backend, payload, aliases):
+        # type: (str, dict, List[str]) -> str
+        found = list()  # type: List[str]
+        for alias in aliases:
+            row = self.db.execute(
+                "SELECT id FROM aliases WHERE alias = ?", (alias,)
+            ).fetchone()
+            if row and row[0] not in found:
+                found.append(row[0])
+        canonical = found[0] if found else aliases[0]
+
+        data = self.get(canonical)
+        for other in found[1:]:
+            # the payload links records stored separately; merge them.
+            for k, v in self.get(other).items():
+                data.setdefault(k, v)
+            self.db.execute(
+                "UPDATE aliases SET id = ? WHERE id = ?", (canonical, other)
+            )
+            self.db.execute("DELETE FROM records WHERE id = ?", (other,))
+        data[backend] = payload
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO records (id, data, updated) VALUES (?, ?, ?)",
+            (canonical, json.dumps(data), time.time()),
+        )
+        self.db.executemany(
+            "INSERT OR REPLACE INTO aliases (alias, id) VALUES (?, ?)",
+            [(a, canonical) for a in aliases],
+        )
+        return canonical
+
+
+_local = threading.local()  # SQLite connections cannot be shared by threads
+
+
+def default_store():
+    # type: () -> Optional[Store]
+    """Return the store shared in this thread, or None if unavailable."""
+    if getattr(_local, "store", None) is None and not getattr(_local, "failed", False):
+        try:
+            _local.store = Store()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("local store is not available: " + e.__str__())
+            _local.failed = True
+    return getattr(_local, "store", None)
+
+
+def loaded_store():
+    # type: () -> Optional[Store]
+    """Return the store if already opened in this thread, or None."""
+    return getattr(_local, "store", None)
+
+
+def close_default_store():
+    # type: () -> None
+    """Close the store of this thread, if opened; it is opened again on demand."""
+    store = getattr(_local, "store", None)
+    if store is not None:
+        _local.store = None
+        store.close()
+
+
+def recall(key, backend=None):
+    # type: (str, Optional[str]) -> Dict[str, dict]
+    """Return the stored record for the key, or an empty dictionary.
+
+    `backend` is the one to which the key is given; see `aliases_of_key`.
+    """
+    store = default_store()
+    if store is None:
+        return dict()
+    try:
+        return store.find(key, backend)
+    except sqlite3.Error as e:
+        logger.warning("failed to read the local store: " + e.__str__())
+        return dict()
+
+
+def remember(backend, payload):
+    # type: (str, dict) -> None
+    """Save the payload in the default store; failures are only logged."""
+    store = default_store()
+    if store is None:
+        return
+    try:
+        store.save(backend, payload)
+    except ValueError as e:
+        logger.debug("record not stored: " + e.__str__())
+    except sqlite3.Error as e:
+        logger.warning("failed to write the local store: " + e.__str__())
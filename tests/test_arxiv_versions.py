@@ -0,0 +1,68 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+import datetime
+
+import pytest
+
+import heprefs.store as store
+from heprefs.arxiv_article import ArxivArticle, VersionNotFound
+
+"""
+    Versions of arXiv articles, with the arXiv API replaced by stubs.
+"""
+
+
+Result = namedtuple(
+    "Result", ["entry_id", "updated", "title", "authors", "pdf_url", "doi"]
+)
+
+
+def result(version):
+    entry_id = "http://arxiv.org/abs/1601.00001v{}".format(version)
+    return Result(
+        entry_id=entry_id,
+        updated=datetime.datetime(2016, 1, version),
+        title="Title v{}".format(version),
+        authors=["A. Author"],
+        pdf_url=entry_id.replace("/abs/", "/pdf/"),
+        doi=None,
+    )
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    """Stub of the arXiv API serving `server["latest"]` versions."""
+    monkeypatch.setenv("HEPREFS_CACHE_DIR", str(tmp_path))
+    store.close_default_store()
+    state = {"latest": 1, "calls": 0}
+
+    def get_info(cls, arxiv_id):
+        state["calls"] += 1
+        return result(state["latest"])
+
+    def get_infos(cls, ids):
+        state["calls"] += 1
+        return [result(int(i.rsplit("v", 1)[1])) for i in ids]
+
+    monkeypatch.setattr(ArxivArticle, "get_info", classmethod(get_info))
+    monkeypatch.setattr(ArxivArticle, "get_infos", classmethod(get_infos))
+    yield state
+    store.close_default_store()
+
+
+def test_version_released_after_stored(server):
+    assert ArxivArticle("1601.00001").title() == "Title v1"  # stored here
+    server["latest"] = 2
+    assert ArxivArticle("1601.00001v2").title() == "Title v2"
+    article = ArxivArticle("1601.00001")
+    article.set_version(2)
+    assert article.title() == "Title v2"
+
+
+def test_version_not_found(server):
+    server["latest"] = 2
+    assert ArxivArticle("1601.00001v1").title() == "Title v1"
+    calls = server["calls"]
+    with pytest.raises(VersionNotFound):
+        ArxivArticle("1601.00001v3").title()
+    assert server["calls"] == calls + 1  # only the latest entry is fetched again
@@ -0,0 +1,66 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+import heprefs.completion as completion
+import heprefs.store as store
+from heprefs.library import Library
+
+"""
+    Shell completion from the index of the store and the library.
+"""
+
+
+@pytest.fixture
+def record_store(monkeypatch, tmp_path):
+    monkeypatch.setenv("HEPREFS_CACHE_DIR", str(tmp_path))
+    store.close_default_store()
+    record_store = store.default_store()
+    record_store.save(
+        "arxiv",
+        {
+            "entry_id": "http://arxiv.org/abs/1505.02996v2",
+            "updated": "",
+            "title": "Arxiv  title",
+            "authors": [],
+            "pdf_url": "",
+            "doi": "10.1103/PhysRevD.92.055017",
+        },
+    )
+    yield record_store
+    store.close_default_store()
+
+
+def test_doi_regardless_of_case(record_store):
+    completion.build_index(record_store)
+    for prefix in ["10.1103/PhysRev", "10.1103/physrevd.92"]:
+        assert completion.complete(prefix) == [
+            ("10.1103/PhysRevD.92.055017", "Arxiv title")
+        ]
+
+
+def test_files_described_by_titles(record_store, tmp_path):
+    for name, identifier in [
+        ("a.pdf", "arxiv:1505.02996v2"),
+        ("b.pdf", "arxiv:1701.00001"),
+    ]:
+        (tmp_path / name).write_bytes(b"%PDF")
+        Library(record_store).register(str(tmp_path / name), identifier)
+    completion.build_index(record_store)
+    assert dict(completion.complete("1505")) == {
+        "1505.02996": "Arxiv title",
+        "1505.02996v2": "Arxiv title",
+    }
+    assert completion.complete("1701") == [("1701.00001", "b.pdf")]
+
+
+def test_update_as_build(record_store, tmp_path):
+    completion.build_index(record_store)
+    record_store.save(
+        "ins", {"recid": 1, "title": {"title": "New"}, "doi": "10.5555/MixedCase"}
+    )
+    completion.update_index(record_store)
+    updated = (tmp_path / "completion.idx").read_bytes()
+    completion.build_index(record_store)
+    assert updated == (tmp_path / "completion.idx").read_bytes()
+    assert completion.complete("10.5555/m") == [("10.5555/MixedCase", "New")]
@@ -0,0 +1,81 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import gzip
+import io
+import json
+
+import pytest
+
+import heprefs.ingest as ingest
+import heprefs.store as store
+
+"""
+    Parsing and ingestion of JSON dumps.
+"""
+
+
+RECORDS = [
+    {
+        "recid": recid,
+        "title": {"title": "Paper {}".format(recid)},
+        "authors": [{"full_name": "Author, A."}, {"full_name": "Author, B."}],
+        "primary_report_number": ["arXiv:1505.{:05d}".format(recid)],
+    }
+    for recid in range(1, 6)
+]
+
+
+def parse(text, read_size=ingest.READ_SIZE):
+    counts = dict()  # type: dict
+    records = list(ingest.iter_records(io.StringIO(text), read_size, counts))
+    return records, counts.get("malformed", 0)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+@pytest.mark.parametrize(
+    "text",
+    [
+        "".join(json.dumps(r) + "\n" for r in RECORDS),
+        json.dumps(RECORDS),
+        json.dumps(RECORDS, indent=2),
+        "".join(json.dumps(r) for r in RECORDS),
+    ],
+)
+def test_formats(text, read_size):
+    assert parse(text, read_size) == (RECORDS, 0)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+def test_records_after_malformed_line(read_size):
+    text = '{"a":1}\n{"broken": \n{"b":2}\n{"c":3}\n{"d":4}\n'
+    assert parse(text, read_size) == ([{"a": 1}, {"b": 2}, {"c": 3}, {"d": 4}], 1)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+def test_nested_objects_after_malformed_record(read_size):
+    lines = json.dumps(RECORDS, indent=2).splitlines()
+    # the title of the second record is broken
+    i = [n for n, line in enumerate(lines) if "Paper 2" in line][0]
+    lines[i] = lines[i].replace('"Paper 2"', '"Paper 2')
+    assert parse("\n".join(lines), read_size) == (RECORDS[:1] + RECORDS[2:], 1)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+def test_truncated_record(read_size):
+    text = json.dumps(RECORDS, indent=2)
+    assert parse(text[:-50], read_size) == (RECORDS[:-1], 1)
+    text = "".join(json.dumps(r) + "\n" for r in RECORDS)
+    assert parse(text[:-20], read_size) == (RECORDS[:-1], 1)
+
+
+def test_ingest_gzip(tmp_path, monkeypatch):
+    monkeypatch.setenv("HEPREFS_CACHE_DIR", str(tmp_path))
+    store.close_default_store()
+    path = str(tmp_path / "dump.json.gz")
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps(RECORDS[:2]) + "\n")
+        f.write('{"recid": 3, "title": \n')
+        f.write(json.dumps({"metadata": {"titles": []}}) + "\n")
+    counts = ingest.ingest(store.default_store(), path, jobs=1)
+    assert counts == {"records": 3, "stored": 2, "malformed": 1, "skipped": 1}
+    assert store.default_store().find("arXiv:1505.00002")["ins"]["recid"] == 2
+    store.close_default_store()
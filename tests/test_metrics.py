@@ -0,0 +1,158 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # type: ignore
+    from urlparse import parse_qs, urlparse  # type: ignore
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+"""
+    `heprefs metrics` against a local stub of the inspireHEP search API.
+"""
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_PAPERS = 400
+
+
+def paper(recid):
+    return {
+        "recid": recid,
+        "title": {"title": "Paper {}".format(recid)},
+        "primary_report_number": ["arXiv:1505.{:05d}".format(recid)],
+        "doi": "10.1000/P{}".format(recid),
+        "number_of_citations": recid % 50,
+    }
+
+
+PAPERS = [paper(recid) for recid in range(1, N_PAPERS + 1)]
+# a record without report numbers, which is found only by general queries
+PAPERS.append(
+    {
+        "recid": 9999,
+        "title": {"title": "No number"},
+        "primary_report_number": [],
+        "number_of_citations": 7,
+    }
+)
+
+
+def matches(query, record):
+    eprints = re.findall(r"eprint (\S+)", query)
+    dois = [d.lower() for d in re.findall(r"doi (\S+)", query)]
+    recids = [int(r) for r in re.findall(r"recid:(\d+)", query)]
+    if not (eprints or dois or recids):
+        return True  # general queries match all the records
+    numbers = [n[6:] for n in record["primary_report_number"]]
+    return (
+        any(e in numbers for e in eprints)
+        or record.get("doi", "").lower() in dois
+        or record["recid"] in recids
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = list()  # type: list
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        StubHandler.requests.append(params)
+        size = min(int(params["rg"][0]), 200)
+        start = int(params["jrec"][0]) - 1
+        found = [r for r in PAPERS if matches(params["p"][0], r)]
+        body = json.dumps(found[start : start + size]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(tmp_path):
+    server = HTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    del StubHandler.requests[:]
+    env = dict(os.environ)
+    env["HEPREFS_INSPIRE_API"] = "http://127.0.0.1:{}/search".format(
+        server.server_address[1]
+    )
+    env["HEPREFS_CACHE_DIR"] = str(tmp_path)
+    env["PYTHONPATH"] = ROOT
+    yield env
+    server.shutdown()
+    server.server_close()
+
+
+def run_metrics(env, args, stdin=""):
+    process = subprocess.run(
+        [sys.executable, "-c", "from heprefs.heprefs import heprefs_main as m; m()"]
+        + ["metrics"]
+        + args,
+        input=stdin,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert process.returncode == 0, process.stderr
+    rows = [line.split("\t") for line in process.stdout.splitlines()]
+    summary = dict(
+        (line[0][2:].split(": ")[0], int(line[0].split(": ")[1]))
+        for line in rows
+        if line[0].startswith("# ")
+    )
+    return [r for r in rows if not r[0].startswith("# ")], summary, process.stderr
+
+
+def h_index(counts):
+    counts = sorted(counts, reverse=True)
+    return max([i + 1 for i, c in enumerate(counts) if c >= i + 1] or [0])
+
+
+def test_many_keys_by_few_requests(stub):
+    keys = ["1505.{:05d}".format(recid) for recid in range(1, N_PAPERS + 1)]
+    rows, summary, _ = run_metrics(stub, [], stdin="\n".join(keys) + "\n")
+    counts = [p["number_of_citations"] for p in PAPERS[:N_PAPERS]]
+    assert len(rows) == N_PAPERS
+    assert summary == {
+        "papers": N_PAPERS,
+        "citations": sum(counts),
+        "h_index": h_index(counts),
+    }
+    assert len(StubHandler.requests) <= 12
+
+
+def test_keys_of_the_same_paper(stub):
+    rows, summary, stderr = run_metrics(
+        stub, ["1505.00002", "1505.00002v2", "10.1000/p3", "doi:10.1000/P3"]
+    )
+    assert "not found" not in stderr
+    assert sorted(r[0] for r in rows) == [
+        "10.1000/p3",
+        "1505.00002",
+        "1505.00002v2",
+        "doi:10.1000/P3",
+    ]
+    assert summary["papers"] == 2
+    assert summary["citations"] == 5
+
+
+def test_query_with_empty_report_numbers(stub):
+    rows, summary, _ = run_metrics(stub, ["-q", "find a stub"])
+    assert len(rows) == N_PAPERS + 1
+    assert ["9999", "9999", "7", "No number"] in rows
+    assert summary["papers"] == N_PAPERS + 1